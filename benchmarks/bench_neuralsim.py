@@ -0,0 +1,96 @@
+"""
+Micro-benchmarks for the neural simulators.
+Run from the repository root:
+    python -m benchmarks.bench_neuralsim
+"""
+import timeit
+import numpy as np
+
+import neuralsim
+
+
+def time_per_call(fn, number=2000, repeat=5):
+    # best-of-repeat average time per call, in microseconds
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def bench_single_sample(chan_counts=(96, 256, 1000), num_dof=5):
+    """Per-frame cost of simulating one bin online: generate() vs generate_one()"""
+    print(f"\nSingle-sample generation ({num_dof} DoF), time per call:")
+    print(f"{'chans':>8} {'generate':>14} {'generate_one':>14} {'speedup':>9}")
+    for num_chans in chan_counts:
+        sim = neuralsim.LogLinUnitGenerator(num_chans, num_dof, pos_mult=0.5, vel_mult=2, noise_level=0.1)
+        pos = np.random.uniform(0, 1, num_dof)
+        vel = np.random.normal(0, 0.01, num_dof)
+        out = np.empty(num_chans)
+        t_gen = time_per_call(lambda: sim.generate(pos, vel))
+        t_one = time_per_call(lambda: sim.generate_one(pos, vel, out=out))
+        print(f"{num_chans:>8} {t_gen:>11.1f} us {t_one:>11.1f} us {t_gen / t_one:>8.1f}x")
+
+
+def bench_poisson_realtime(num_chans=1000, num_dof=5, seconds=10.0, bin_ms=20, resolution_ms=1):
+    """Throughput of the spike-level simulator at 1 ms resolution, relative to real time"""
+    sim = neuralsim.PoissonSpikeGenerator(num_chans, num_dof, pos_mult=0.5, vel_mult=2,
+                                          bin_ms=bin_ms, resolution_ms=resolution_ms)
+    num_bins = int(seconds * 1000 / bin_ms)
+    pos = np.random.uniform(0, 1, (num_bins, num_dof))
+    vel = np.random.normal(0, 0.01, (num_bins, num_dof))
+
+    print(f"\nPoisson spikes, {num_chans} chans at {1000 / resolution_ms:.0f} Hz resolution, {seconds:.0f} s of data:")
+    for name, fn in [("generate (binned counts)", lambda: sim.generate(pos, vel)),
+                     ("generate_spikes (CSR)", lambda: sim.generate_spikes(pos, vel)),
+                     ("generate_spike_times", lambda: sim.generate_spike_times(pos, vel))]:
+        elapsed = min(timeit.repeat(fn, number=1, repeat=3))
+        print(f"{name:>26}: {elapsed * 1000:8.1f} ms  ({seconds / elapsed:7.1f}x real time)")
+    t_one = time_per_call(lambda: sim.generate_one(pos[0], vel[0]), number=500)
+    print(f"{'generate_one (per bin)':>26}: {t_one:8.1f} us  ({bin_ms * 1000 / t_one:7.1f}x real time)")
+
+
+def bench_broadband(chan_counts=(96, 128, 256), num_dof=2, bin_ms=20, num_bins=250):
+    """Cost per bin of the 30 kHz broadband simulator, against the real-time budget of one bin"""
+    print(f"\nBroadband (30 kHz) simulation + filtering + threshold crossings, {bin_ms} ms bins:")
+    print(f"{'chans':>8} {'p50/bin':>10} {'p99/bin':>10} {'chunked/bin':>12} {'real time':>10}")
+    for num_chans in chan_counts:
+        rates = neuralsim.LogLinUnitGenerator(num_chans, num_dof, pos_mult=0.5, vel_mult=2)
+        sim = neuralsim.BroadbandSimulator(rates, bin_ms=bin_ms)
+        pos = np.random.uniform(0, 1, (num_bins, num_dof))
+        vel = np.random.normal(0, 0.01, (num_bins, num_dof))
+
+        # online: one bin per call, as RealTimeDecoder does
+        per_bin = []
+        for i in range(num_bins):
+            start = timeit.default_timer()
+            sim.generate_one(pos[i], vel[i])
+            per_bin.append(timeit.default_timer() - start)
+        p50, p99 = np.percentile(per_bin, [50, 99]) * 1000
+
+        # offline: chunked generation of a training set
+        chunked = min(timeit.repeat(lambda: sim.generate(pos, vel), number=1, repeat=3)) / num_bins * 1000
+        print(f"{num_chans:>8} {p50:>7.2f} ms {p99:>7.2f} ms {chunked:>9.2f} ms {bin_ms / p99:>9.1f}x")
+
+
+def bench_high_channel_count(chan_counts=(1000, 5000, 10000), num_dof=5, num_steps=1000, tuned_frac=0.1):
+    """Dense float64 vs dense float32 vs sparse tuning, for offline (batch) and online (single-sample) generation"""
+    configs = [("dense float64", np.float64, 1.0),
+               ("dense float32", np.float32, 1.0),
+               (f"sparse {tuned_frac:.0%} float32", np.float32, tuned_frac)]
+    print(f"\nHigh channel counts, {num_steps} timesteps ({num_dof} DoF):")
+    print(f"{'chans':>8} {'config':>20} {'generate':>11} {'output MB':>10} {'firing_rate':>12} {'generate_one':>13}")
+    for num_chans in chan_counts:
+        pos = np.random.uniform(0, 1, (num_steps, num_dof))
+        vel = np.random.normal(0, 0.01, (num_steps, num_dof))
+        for name, dtype, frac in configs:
+            sim = neuralsim.LogLinUnitGenerator(num_chans, num_dof, pos_mult=0.5, vel_mult=2, dtype=dtype,
+                                                tuned_frac=frac)
+            t_gen = min(timeit.repeat(lambda: sim.generate(pos, vel), number=1, repeat=3)) * 1000
+            out_mb = sim.generate(pos, vel).nbytes / 1e6
+            t_rate = min(timeit.repeat(lambda: sim.firing_rate(pos, vel), number=1, repeat=3)) * 1000
+            t_one = time_per_call(lambda: sim.generate_one(pos[0], vel[0]), number=200)
+            print(f"{num_chans:>8} {name:>20} {t_gen:>8.1f} ms {out_mb:>10.1f} {t_rate:>9.1f} ms {t_one:>10.1f} us")
+
+
+if __name__ == "__main__":
+    bench_single_sample()
+    bench_poisson_realtime()
+    bench_broadband()
+    bench_high_channel_count()
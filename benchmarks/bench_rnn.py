@@ -0,0 +1,47 @@
+"""
+Per-step latency of the RNN decoder when streaming one bin at a time (as RealTimeDecoder does).
+Run from the repository root:
+    python -m benchmarks.bench_rnn
+"""
+import timeit
+import numpy as np
+import torch
+
+import decoders.rnn
+
+
+def step_latencies(fn, xs, warmup=50):
+    # per-call times in microseconds
+    for x in xs[:warmup]:
+        fn(x)
+    times = []
+    for x in xs:
+        start = timeit.default_timer()
+        fn(x)
+        times.append(timeit.default_timer() - start)
+    return np.array(times) * 1e6
+
+
+def bench_step(rnn_types=("rnn", "gru", "lstm"), hidden_sizes=(128, 256, 512, 1024), num_chans=100, num_outputs=4,
+               num_steps=2000):
+    """p50/p99 per-step time: online forward() vs step() (eager) vs step() (TorchScript)"""
+    print(f"\nRNN single-step latency, {num_chans} chans, {torch.get_num_threads()} torch threads (p50 / p99 in us):")
+    print(f"{'type':>6} {'hidden':>7} {'forward':>17} {'step (eager)':>17} {'step (script)':>17} {'speedup p50':>12}")
+    xs = np.random.randn(num_steps, num_chans).astype(np.float32)
+    for rnn_type in rnn_types:
+        for hidden_size in hidden_sizes:
+            model = decoders.rnn.RNN(num_chans, num_outputs, hidden_size=hidden_size, rnn_type=rnn_type)
+            model.enable_online(True)
+            t_forward = step_latencies(lambda x: model(torch.Tensor(x).reshape(1, 1, -1)), xs)
+            model.init_step(script=False)
+            t_eager = step_latencies(model.step, xs)
+            model.init_step(script=True)
+            t_script = step_latencies(model.step, xs)
+
+            cols = [f"{np.percentile(t, 50):7.1f} / {np.percentile(t, 99):7.1f}" for t in (t_forward, t_eager, t_script)]
+            speedup = np.percentile(t_forward, 50) / np.percentile(t_script, 50)
+            print(f"{rnn_type:>6} {hidden_size:>7} {cols[0]:>17} {cols[1]:>17} {cols[2]:>17} {speedup:>11.1f}x")
+
+
+if __name__ == "__main__":
+    bench_step()
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+
+
+CACHE_DIR = os.path.join("data", "cache")
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3     # evict least-recently-used entries beyond 4 GB
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    """Content hash of a file (e.g. a movement dataset)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_object(obj):
+    """Hash of a picklable object's parameters (e.g. a fake brain, whose pickle holds its tuning matrix)"""
+    return hash_bytes(pickle.dumps(obj))
+
+
+def cache_key(**params):
+    """Key for a cache entry, from JSON-serializable params (use hash_file / hash_object for files and objects)"""
+    return hash_bytes(json.dumps(params, sort_keys=True).encode())
+
+
+class DataCache:
+    """
+    Content-addressed on-disk cache for preprocessed training data.
+
+    Each entry is a folder named by its key, holding one .npy file per array (loaded memory-mapped) and a pickle of
+    any other objects (e.g. fitted scalers). Entries are written to a temporary folder and renamed into place, so an
+    interrupted save never leaves a partial entry. When the cache grows beyond max_bytes, the least-recently-used
+    entries are deleted (loading an entry marks it as used).
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def load(self, key):
+        """Returns (arrays, objects) dicts for the entry, or None if it isn't cached"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return None
+        with open(os.path.join(entry_dir, "objects.pkl"), 'rb') as f:
+            objects = pickle.load(f)
+        arrays = {fname[:-4]: np.load(os.path.join(entry_dir, fname), mmap_mode='r')
+                  for fname in os.listdir(entry_dir) if fname.endswith(".npy")}
+        os.utime(entry_dir)     # mark as recently used
+        return arrays, objects
+
+    def save(self, key, arrays, objects=None):
+        """Save a dict of np.arrays (and optionally a dict of other picklable objects) under key"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(arr))
+        with open(os.path.join(tmp_dir, "objects.pkl"), 'wb') as f:
+            pickle.dump(objects or {}, f)
+
+        if os.path.isdir(entry_dir):
+            # another process saved the same entry first - the contents are identical
+            shutil.rmtree(tmp_dir)
+        else:
+            os.replace(tmp_dir, entry_dir)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Delete least-recently-used entries until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name == keep or '.tmp' in name or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        total = sum(size for _, size, _ in entries)
+        if keep is not None and os.path.isdir(os.path.join(self.cache_dir, keep)):
+            keep_dir = os.path.join(self.cache_dir, keep)
+            total += sum(os.path.getsize(os.path.join(keep_dir, f)) for f in os.listdir(keep_dir))
+
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,161 @@
+import fnmatch
+import json
+import os
+import numpy as np
+
+import data_loading
+
+
+CATALOG_FNAME = "catalog.json"
+
+
+def summarize_dataset(path):
+    """
+    Catalog entry for one movement dataset: size/duration/DoF/trials/online fraction, plus (for .npy datasets) the
+    byte offset and layout of the records so they can be memory-mapped without parsing the file again.
+    """
+    entry = {
+        "name": os.path.basename(path),
+        "format": os.path.splitext(path)[1][1:],
+        "size_bytes": os.path.getsize(path),
+        "mtime": os.path.getmtime(path),
+        "data_offset": None,
+        "record_size": None,
+        "descr": None,
+    }
+    if entry["format"] == "npy":
+        data = np.load(path, mmap_mode='r')
+        entry["data_offset"] = data.offset
+        entry["record_size"] = data.dtype.itemsize
+        entry["descr"] = np.lib.format.dtype_to_descr(data.dtype)
+    else:
+        data = data_loading.load_movedata(path)
+
+    entry["num_samples"] = len(data)
+    entry["num_dof"] = int(data.dtype["current_position"].shape[0])
+    entry["duration_s"] = float(data["timestep"][-1] - data["timestep"][0]) / 1000 if len(data) else 0.0
+    entry["num_trials"] = len(np.unique(data["trial_number"]))
+    entry["online_frac"] = float(np.mean(data["online"])) if len(data) else 0.0
+    return entry
+
+
+class DatasetCatalog:
+    """
+    Index of the movement datasets in a folder (data/movedata by default), stored as catalog.json in that folder.
+    Entries are only recomputed for files that are new or changed (by size/mtime), so listing hundreds of sessions
+    doesn't require loading any of them. DataRecorder adds each dataset it saves.
+    """
+    def __init__(self, data_dir=data_loading.MOVEDATA_DIR):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, CATALOG_FNAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = {e["name"]: e for e in json.load(f)}
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(sorted(self.entries.values(), key=lambda e: e["name"]), f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def update(self, path):
+        """Add or refresh the entry for one dataset file, and save the catalog"""
+        self.entries[os.path.basename(path)] = summarize_dataset(path)
+        self.save()
+
+    def scan(self, verbose=False):
+        """Sync the catalog with the folder: index new/changed datasets and drop deleted ones"""
+        names = sorted(f for f in os.listdir(self.data_dir)
+                       if f.startswith("dataset_") and os.path.splitext(f)[1] in (".npy", ".pkl"))
+        for name in names:
+            path = os.path.join(self.data_dir, name)
+            entry = self.entries.get(name)
+            if entry is None or entry["size_bytes"] != os.path.getsize(path) or entry["mtime"] != os.path.getmtime(path):
+                if verbose:
+                    print(f"indexing {name}")
+                self.entries[name] = summarize_dataset(path)
+        for name in set(self.entries) - set(names):
+            del self.entries[name]
+        self.save()
+
+    def query(self, num_dof=None, online=None, min_duration=None, max_duration=None, pattern=None):
+        """
+        Filter the catalog. online=True keeps sessions with any online (decoder-controlled) frames, online=False keeps
+        fully offline sessions. pattern is a glob on the file name. Returns a list of entries sorted by name.
+        """
+        results = []
+        for entry in sorted(self.entries.values(), key=lambda e: e["name"]):
+            if num_dof is not None and entry["num_dof"] != num_dof:
+                continue
+            if online is not None and (entry["online_frac"] > 0) != online:
+                continue
+            if min_duration is not None and entry["duration_s"] < min_duration:
+                continue
+            if max_duration is not None and entry["duration_s"] > max_duration:
+                continue
+            if pattern is not None and not fnmatch.fnmatch(entry["name"], pattern):
+                continue
+            results.append(entry)
+        return results
+
+    def open(self, entries):
+        """Open several datasets as one lazily concatenated dataset"""
+        return ConcatMovedata(self.data_dir, entries)
+
+
+class ConcatMovedata:
+    """
+    Several movement datasets viewed as one sequence of records, without loading them. .npy datasets are
+    memory-mapped at their cataloged byte offsets; legacy .pkl datasets are only loaded when first accessed.
+    Index with an int or a slice (which materializes just the requested rows), or use `column` for one field.
+    """
+    def __init__(self, data_dir, entries):
+        if len({e["num_dof"] for e in entries}) > 1:
+            raise ValueError("Can only concatenate datasets with the same number of DoF")
+        self.data_dir = data_dir
+        self.entries = list(entries)
+        self.bounds = np.concatenate([[0], np.cumsum([e["num_samples"] for e in self.entries])])
+        self._parts = [None] * len(self.entries)
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    def part(self, i):
+        """Records of the i-th dataset (memory-mapped for .npy datasets)"""
+        if self._parts[i] is None:
+            entry = self.entries[i]
+            path = os.path.join(self.data_dir, entry["name"])
+            if entry["data_offset"] is not None:
+                self._parts[i] = np.memmap(path, dtype=np.lib.format.descr_to_dtype(entry["descr"]), mode='r',
+                                           offset=entry["data_offset"], shape=(entry["num_samples"],))
+            else:
+                self._parts[i] = data_loading.load_movedata(path)
+        return self._parts[i]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                raise ValueError("Only contiguous slices are supported")
+            return self._rows(start, stop)
+        if idx < 0:
+            idx += len(self)
+        i = int(np.searchsorted(self.bounds, idx, side='right')) - 1
+        return self.part(i)[idx - self.bounds[i]]
+
+    def column(self, name, start=0, stop=None):
+        """One field (e.g. "current_position") for rows [start, stop) across datasets"""
+        return self._rows(start, len(self) if stop is None else stop, name)
+
+    def _rows(self, start, stop, name=None):
+        # only touch the datasets overlapping [start, stop)
+        chunks = []
+        for i in range(len(self.entries)):
+            lo, hi = max(start, self.bounds[i]), min(stop, self.bounds[i + 1])
+            if lo < hi:
+                part = self.part(i) if name is None else self.part(i)[name]
+                chunks.append(np.asarray(part[lo - self.bounds[i]:hi - self.bounds[i]]))
+        if not chunks:
+            return self.part(0)[:0] if name is None else self.part(0)[name][:0]
+        return np.concatenate(chunks)
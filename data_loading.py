@@ -1,13 +1,68 @@
+import os
+import pickle
+import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
 
 
-def add_time_history(x, seq_len=3):
+MOVEDATA_DIR = os.path.join("data", "movedata")
+
+
+def movedata_path(dataset_fname):
+    """Path of a movement dataset in data/movedata, trying the .npy then the (legacy) .pkl extension if none is given"""
+    if dataset_fname.endswith(".npy") or dataset_fname.endswith(".pkl"):
+        return os.path.join(MOVEDATA_DIR, dataset_fname)
+    for ext in (".npy", ".pkl"):
+        if os.path.exists(os.path.join(MOVEDATA_DIR, dataset_fname + ext)):
+            return os.path.join(MOVEDATA_DIR, dataset_fname + ext)
+    return os.path.join(MOVEDATA_DIR, dataset_fname + ".pkl")
+
+
+def load_movedata(path, mmap_mode=None):
+    """
+    Load a movement dataset saved by DataRecorder, as a structured array with fields timestep, trial_number,
+    current_position (num_timepts, num_dof), target_position, online and decodername.
+    Legacy .pkl datasets (pandas DataFrames with one row per frame) are converted to the same format.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode=mmap_mode)
+
+    from data_recorder import record_dtype
+    with open(path, 'rb') as f:
+        df = pickle.load(f)
+    pos = np.stack(df.current_position.to_numpy())
+    data = np.empty(len(df), dtype=record_dtype(pos.shape[1]))
+    data["timestep"] = df.timestep.to_numpy()
+    data["trial_number"] = df.trial_number.to_numpy()
+    data["current_position"] = pos
+    data["target_position"] = np.stack(df.target_position.to_numpy())
+    data["online"] = df.online.to_numpy()
+    data["decodername"] = [name or "" for name in df.decodername]
+    return data
+
+
+def scaler_affine(scaler, num_features):
+    """
+    (mean, scale) of a fitted sklearn StandardScaler as float64 arrays of shape (num_features,), so that
+    scaler.transform(x) == (x - mean) / scale. Used to fold normalization into decoder weights.
+    """
+    mean = scaler.mean_ if getattr(scaler, "mean_", None) is not None and scaler.with_mean else np.zeros(num_features)
+    scale = scaler.scale_ if getattr(scaler, "scale_", None) is not None and scaler.with_std else np.ones(num_features)
+    return np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64)
+
+
+def add_time_history(x, seq_len=3, strided=False):
     """
     Adds time history to the input features
     Input shape (num_samples, num_chans)
-    Output shape (num_samples, num_chans, seq_len)
+    Output shape (num_samples, seq_len, num_chans)
+
+    If strided=True, the output is a read-only strided view over a zero-padded copy of the input rather than a
+    materialized tensor, so memory stays O(num_samples x num_chans) regardless of seq_len
     """
+    if strided:
+        return strided_time_history(x, seq_len=seq_len)
+
     xin = torch.tensor(x)
 
     # add time delays to input features
@@ -25,9 +80,62 @@ def add_time_history(x, seq_len=3):
     return xhist
 
 
+def strided_time_history(x, seq_len=3):
+    """
+    Zero-copy version of add_time_history. Pads the start of the data with (seq_len - 1) zero samples and returns
+    overlapping windows as a view (like torch.unfold / np.lib.stride_tricks.sliding_window_view).
+    Input shape (num_samples, num_chans)
+    Output shape (num_samples, seq_len, num_chans), with the last timestep being the most recent data
+    """
+    if isinstance(x, torch.Tensor):
+        x = x.numpy()
+    padded = torch.zeros((x.shape[0] + seq_len - 1, x.shape[1]), dtype=torch.float)
+    padded[seq_len - 1:].numpy()[:] = x     # copy through numpy so read-only (memory-mapped) arrays work too
+
+    # unfold gives shape (num_samples, num_chans, seq_len), permute to (batches, sequence length, features)
+    return padded.unfold(0, seq_len, 1).permute(0, 2, 1)
+
+
+def stream_time_history(chunks, seq_len=3):
+    """
+    Time history for data arriving in blocks (e.g. from neuralsim's generate_stream). The last (seq_len - 1) samples
+    of each block are carried over to the next one, so the concatenated output matches add_time_history on the
+    concatenated input.
+    Input: iterable of arrays of shape (chunk_samples, num_chans)
+    Yields: tensors of shape (chunk_samples, seq_len, num_chans)
+    """
+    tail = None
+    for x in chunks:
+        if isinstance(x, torch.Tensor):
+            x = x.numpy()
+        if tail is None:
+            tail = np.zeros((seq_len - 1, x.shape[1]), dtype=np.float32)
+        padded = np.concatenate([tail, x]).astype(np.float32, copy=False)
+        tail = padded[len(padded) - (seq_len - 1):]
+        yield torch.from_numpy(padded).unfold(0, seq_len, 1).permute(0, 2, 1)
+
+
+def blocked_folds(num_samples, num_folds=5, gap=0):
+    """
+    Contiguous (unshuffled) k-fold splits of a recording. `gap` samples on either side of each held-out fold are left
+    out of its training set, so time-history windows and autocorrelated movements don't leak across the boundary.
+    Returns a list of ((test_start, test_stop), [(train_start, train_stop), ...]) with one entry per fold
+    """
+    if not 2 <= num_folds <= num_samples:
+        raise ValueError(f"num_folds must be between 2 and the number of samples, got {num_folds}")
+    fold_edges = np.linspace(0, num_samples, num_folds + 1).astype(int)
+    folds = []
+    for a, b in zip(fold_edges[:-1], fold_edges[1:]):
+        train_ranges = [(lo, hi) for lo, hi in [(0, max(a - gap, 0)), (min(b + gap, num_samples), num_samples)]
+                        if hi > lo]
+        folds.append(((int(a), int(b)), [(int(lo), int(hi)) for lo, hi in train_ranges]))
+    return folds
+
+
 class SequenceDataset(Dataset):
     """Simple dataset for sequences of data"""
     def __init__(self, x, y):
+        # .to() is a no-op for float tensors, so strided views from add_time_history are kept as views
         self.x = x.to(torch.float)
         self.y = y.to(torch.float)
 
@@ -35,4 +143,83 @@ class SequenceDataset(Dataset):
         return len(self.x)
 
     def __getitem__(self, idx):
-        return self.x[idx, :], self.y[idx]
\ No newline at end of file
+        return self.x[idx, :], self.y[idx]
+
+
+class WindowedDataset(Dataset):
+    """
+    Dataset that stores only the contiguous (normalized) neural matrix and builds each seq_len window when indexed.
+    `x` can be a numpy array, a np.memmap (e.g. from `from_npy`), or a tensor of shape (num_samples, num_chans).
+    Windows are zero-padded at the start, matching add_time_history.
+
+    Indexing with a list/array of indices gathers the whole batch in one vectorized operation, so use `batch_loader`
+    rather than a default DataLoader to avoid per-item collation.
+    """
+    def __init__(self, x, y, seq_len):
+        self.x = x.numpy() if isinstance(x, torch.Tensor) else np.asanyarray(x)
+        self.y = y.numpy() if isinstance(y, torch.Tensor) else np.asarray(y)
+        self.seq_len = seq_len
+        self.offsets = np.arange(-seq_len + 1, 1)
+
+    @classmethod
+    def from_npy(cls, x_path, y, seq_len):
+        """Memory-map a saved .npy neural matrix, so recordings larger than RAM can be used for training"""
+        return cls(np.load(x_path, mmap_mode='r'), y, seq_len)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, idx):
+        # idx can be a single index or a batch of indices (from a BatchSampler)
+        is_batch = not np.isscalar(idx)
+        idx = np.atleast_1d(np.asarray(idx))
+
+        # gather all windows at once: shape (batch, seq_len, num_chans), with the last timestep the most recent
+        win_idx = idx[:, None] + self.offsets
+        x = self.x[np.maximum(win_idx, 0)].astype(np.float32)
+        x[win_idx < 0] = 0
+        y = self.y[idx].astype(np.float32)
+
+        x, y = torch.from_numpy(x), torch.from_numpy(y)
+        return (x, y) if is_batch else (x[0], y[0])
+
+
+def batch_loader(dataset, batch_size, shuffle=False, drop_last=False):
+    """DataLoader that fetches whole batches from a WindowedDataset with a single gather (no per-item collation)"""
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=drop_last), batch_size=None)
+
+
+class ContiguousChunks:
+    """
+    Batches for truncated backprop through time. The recording is split into `num_streams` contiguous streams (the
+    batch dimension), and each epoch walks through them in consecutive chunks of `chunk_len` timesteps, so the RNN's
+    hidden state can be carried from one chunk to the next. Every timestep is seen once per epoch (instead of seq_len
+    times with overlapping windows).
+
+    Iterating yields (x, y, is_first) with x of shape (num_streams, chunk_len, num_chans), y of shape
+    (num_streams, chunk_len, num_outputs), and is_first=True for the first chunk, where the hidden state should be reset.
+    With random_offset=True, the streams start at a random offset in [0, chunk_len) each epoch so chunk boundaries move.
+    """
+    def __init__(self, x, y, num_streams=16, chunk_len=100, random_offset=True):
+        self.x = x.numpy() if isinstance(x, torch.Tensor) else np.asarray(x)
+        self.y = y.numpy() if isinstance(y, torch.Tensor) else np.asarray(y)
+        self.num_streams = num_streams
+        self.chunk_len = chunk_len
+        self.random_offset = random_offset
+        if len(self.x) < num_streams * (chunk_len + 1):
+            raise ValueError(f"Not enough data for {num_streams} streams of {chunk_len} timestep chunks")
+
+    def __len__(self):
+        return (len(self.x) - self.chunk_len) // self.num_streams // self.chunk_len
+
+    def __iter__(self):
+        offset = np.random.randint(self.chunk_len) if self.random_offset else 0
+        stream_len = len(self) * self.chunk_len
+        # (num_streams, stream_len, features) views of the contiguous data
+        x = self.x[offset:offset + self.num_streams * stream_len].reshape(self.num_streams, stream_len, -1)
+        y = self.y[offset:offset + self.num_streams * stream_len].reshape(self.num_streams, stream_len, -1)
+        for start in range(0, stream_len, self.chunk_len):
+            stop = start + self.chunk_len
+            yield (torch.from_numpy(x[:, start:stop].astype(np.float32)),
+                   torch.from_numpy(y[:, start:stop].astype(np.float32)), start == 0)
@@ -1,44 +1,129 @@
-import pickle
+import atexit
 import datetime
 import os
-import pandas as pd
+import queue
+import shutil
+import threading
+import numpy as np
+
+
+def record_dtype(num_dof):
+    """Fixed-dtype columns of a movement dataset (one row per frame)"""
+    return np.dtype([
+        ("timestep", np.int64),
+        ("trial_number", np.int64),
+        ("current_position", np.float64, (num_dof,)),
+        ("target_position", np.float64, (num_dof,)),
+        ("online", np.bool_),
+        ("decodername", "S32"),
+    ])
 
 
 class DataRecorder:
-    """Records movement data and saves to file"""
-    def __init__(self):
-        self.data = []
+    """
+    Records movement data and saves to file.
+
+    Frames are written into a preallocated (growable) numpy structured array. Every `flush_every` frames the new rows
+    are handed to a background thread that appends them to a `.partial` file, and `save_to_file` only queues the final
+    write, so the task loop is never blocked on disk or serialization. Datasets are saved as `.npy` structured arrays,
+    e.g. `np.load(path)["current_position"]` is a (num_timepts, num_dof) float array.
+    """
+    def __init__(self, save_dir=os.path.join("data", "movedata"), flush_every=250, initial_capacity=4096):
+        self.save_dir = save_dir
+        self.flush_every = flush_every
+        self.initial_capacity = initial_capacity
+        self._queue = queue.Queue()
+        self._writer = None
+        self.reset()
 
     def reset(self):
-        self.data = []
+        self.data = None            # allocated on the first record, once num_dof is known
+        self.num_records = 0
+        self._num_flushed = 0
+        self._fpath = None
 
     def record(self, timestep, trial_number, current_position, target_position, online, decodername=None):
-        entry = {
-            "timestep": timestep,
-            "trial_number": trial_number,
-            "current_position": current_position,
-            "target_position": target_position,
-            "online": online,
-            "decodername": decodername,
-        }
-        self.data.append(entry)
+        if self.data is None:
+            self._start(len(current_position))
+        if self.num_records == len(self.data):
+            grown = np.empty(2 * len(self.data), dtype=self.data.dtype)
+            grown[:self.num_records] = self.data
+            self.data = grown
+
+        self.data[self.num_records] = (timestep, trial_number, current_position, target_position, online,
+                                       decodername or "")
+        self.num_records += 1
+        if self.num_records - self._num_flushed >= self.flush_every:
+            self._flush()
+
+    def get_data(self):
+        """The rows recorded so far, as a structured array"""
+        return self.data[:self.num_records] if self.data is not None else None
 
     def save_to_file(self):
-        if len(self.data) < 1:
+        if self.num_records < 1:
             print("no data - failed to save")
             return
 
-        # convert to dataframe
-        df = pd.DataFrame(self.data)
+        # flush the remaining rows, then let the writer thread assemble the final file
+        print(f"Saving data to {self._fpath}")
+        self._flush()
+        self._queue.put(("finalize", self._fpath, self.data.dtype, self.num_records))
 
-        # save to the data folder
+        self.reset()
+
+    def wait(self):
+        """Block until all queued writes are on disk"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def _start(self, num_dof):
+        self.data = np.empty(self.initial_capacity, dtype=record_dtype(num_dof))
         datestr = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-        fname = f"dataset_{datestr}.pkl"
-        fpath = os.path.join("data", "movedata", fname)
-        with open(fpath, "wb") as f:
-            pickle.dump(df, f)
-        print(f"Saved data to {fpath}")
+        fname = f"dataset_{datestr}.npy"
+        if any(os.path.exists(os.path.join(self.save_dir, fname + ext)) for ext in ("", ".partial")):
+            fname = f"dataset_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.npy"
+        self._fpath = os.path.join(self.save_dir, fname)
 
-        self.reset()
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+            atexit.register(self.wait)
+
+    def _flush(self):
+        if self.num_records > self._num_flushed:
+            rows = self.data[self._num_flushed:self.num_records].copy()
+            self._queue.put(("append", self._fpath, rows))
+            self._num_flushed = self.num_records
+
+    def _write_loop(self):
+        # runs on the background thread: appends row chunks to <fpath>.partial, then writes the final .npy file
+        while True:
+            cmd = self._queue.get()
+            try:
+                if cmd[0] == "append":
+                    _, fpath, rows = cmd
+                    with open(fpath + ".partial", "ab") as f:
+                        f.write(rows.tobytes())
+                elif cmd[0] == "finalize":
+                    _, fpath, dtype, num_records = cmd
+                    self._finalize(fpath, dtype, num_records)
+                    print(f"Saved data to {fpath}")
 
+                    # index the new dataset in the folder's catalog
+                    from data_catalog import DatasetCatalog
+                    DatasetCatalog(os.path.dirname(fpath)).update(fpath)
+            except OSError as e:
+                print(f"ERROR: failed to write {cmd[1]}: {e}")
+            finally:
+                self._queue.task_done()
 
+    @staticmethod
+    def _finalize(fpath, dtype, num_records):
+        # prepend a .npy header to the raw rows, writing to a temp file first so the dataset appears atomically
+        header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (num_records,)}
+        with open(fpath + ".tmp", "wb") as f_out, open(fpath + ".partial", "rb") as f_in:
+            np.lib.format.write_array_header_1_0(f_out, header)
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(fpath + ".tmp", fpath)
+        os.remove(fpath + ".partial")
@@ -0,0 +1,134 @@
+import numpy as np
+import scipy.linalg
+import torch
+import torch.nn as nn
+
+import data_loading
+from decoders.metrics import RunningMetrics
+
+
+class KalmanFilter(nn.Module):
+    """
+    A steady-state Kalman filter decoder, with the [pos, vel] outputs as the state.
+
+    State model:        z_t = A z_{t-1} + w,  w ~ N(0, W)
+    Observation model:  x_t = H z_t + q,      q ~ N(0, Q)
+
+    A, W, H, Q are fit by least squares from the (normalized) training data. The Kalman gain converges quickly, so we
+    precompute its steady-state value K from the Riccati equation, and each step is z_t = M z_{t-1} + K x_t with
+    M = (I - K H) A: two small matmuls and no covariance updates. Like the RNN, the filter keeps its own state, so it
+    only uses the most recent neural bin (train/run with seq_len = 1).
+    """
+
+    def __init__(self, num_inputs, num_outputs, lmbda=1e-3, dtype=np.float64):
+        super().__init__()
+        self.num_inputs = num_inputs    # number of neural channels
+        self.num_outputs = num_outputs  # state size (pos & vel for each dof)
+        self.lmbda = lmbda              # small ridge penalty for the least squares fits
+        self.dtype = np.dtype(dtype)
+        self.A = self.W = self.H = self.Q = None
+        self.K = None                   # steady-state gain, shape (num_outputs, num_inputs)
+        self.M = None                   # (I - K H) A, shape (num_outputs, num_outputs)
+        self.bias = None                # only set on decoders with folded-in scalers (see fold_scalers)
+        self.initial_state = np.zeros(num_outputs, dtype=self.dtype)
+        self.state = None
+        self.is_online = False
+
+    def enable_online(self, is_online=True):
+        # when running online, the state is kept between calls (starting from the mean pos/vel)
+        self.is_online = is_online
+        self.state = self.initial_state.copy() if is_online else None
+        self._kx = np.zeros(self.num_outputs, dtype=self.dtype)
+
+    def fit(self, x, y):
+        # x should have shape (time, features) or (time, sequence length, features), contiguous in time
+        # y should have shape (time, out_features)
+        x, y = self._as_numpy(x), self._as_numpy(y)
+        if x.ndim == 3:
+            x = x[:, -1]
+        reg = self.lmbda * len(y) * np.eye(self.num_outputs)
+
+        # state model, fit on consecutive timesteps: z_t ~ A z_{t-1}
+        z_prev, z_next = y[:-1], y[1:]
+        self.A = np.linalg.solve(np.dot(z_prev.T, z_prev) + reg, np.dot(z_prev.T, z_next)).T
+        resid = z_next - np.dot(z_prev, self.A.T)
+        self.W = np.dot(resid.T, resid) / len(resid)
+
+        # observation model: x_t ~ H z_t
+        self.H = np.linalg.solve(np.dot(y.T, y) + reg, np.dot(y.T, x)).T
+        resid = x - np.dot(y, self.H.T)
+        self.Q = np.dot(resid.T, resid) / len(resid)
+
+        self.solve_gain()
+
+    def solve_gain(self):
+        """Steady-state gain from the discrete algebraic Riccati equation for the prior state covariance"""
+        p = scipy.linalg.solve_discrete_are(self.A.T, self.H.T, self.W, self.Q)
+        # K = P H^T (H P H^T + Q)^-1, via a solve with the symmetric (H P H^T + Q)
+        s = np.dot(np.dot(self.H, p), self.H.T) + self.Q
+        k = scipy.linalg.solve(s, np.dot(self.H, p), assume_a='pos').T
+        self.K = k.astype(self.dtype)
+        self.M = np.dot(np.eye(self.num_outputs) - np.dot(k, self.H), self.A).astype(self.dtype)
+
+    def forward(self, x):
+        # x should have shape (time, features) or (time, sequence length, features), contiguous in time.
+        # Runs the filter over the whole sequence, starting from the current state (or the mean pos/vel when offline)
+        x = self._as_numpy(x)
+        if x.ndim == 3:
+            x = x[:, -1]
+        kx = np.dot(x, self.K.T)
+        if self.bias is not None:
+            kx += self.bias
+        z = self.state if self.is_online else self.initial_state
+        y_pred = np.empty((len(x), self.num_outputs), dtype=self.dtype)
+        for t in range(len(x)):
+            z = np.dot(self.M, z) + kx[t]
+            y_pred[t] = z
+        if self.is_online:
+            self.state[:] = z
+        return y_pred
+
+    def forward_online(self, x, out):
+        """One filter step on the newest bin of a (seq_len, features) history, into a preallocated out array"""
+        np.dot(self.K, x[-1], out=self._kx)
+        np.dot(self.M, self.state, out=out)
+        out += self._kx
+        if self.bias is not None:
+            out += self.bias
+        self.state[:] = out
+        return out
+
+    def fold_scalers(self, neural_scaler, output_scaler):
+        """
+        A copy of this decoder that works on raw (unnormalized) neural data, with the state in unnormalized units.
+        With D_x = diag(s_x) and D_y = diag(s_y): M' = D_y M D_y^-1, K' = D_y K D_x^-1 and
+        b' = mu_y - M' mu_y - K' mu_x, so each step is z_t = M' z_{t-1} + K' x_t + b'.
+        """
+        mean_x, scale_x = data_loading.scaler_affine(neural_scaler, self.num_inputs)
+        mean_y, scale_y = data_loading.scaler_affine(output_scaler, self.num_outputs)
+        m = self.M.astype(np.float64) * scale_y[:, None] / scale_y[None, :]
+        k = self.K.astype(np.float64) * scale_y[:, None] / scale_x[None, :]
+
+        folded = KalmanFilter(self.num_inputs, self.num_outputs, lmbda=self.lmbda, dtype=self.dtype)
+        folded.A, folded.W, folded.H, folded.Q = self.A, self.W, self.H, self.Q
+        folded.M = m.astype(self.dtype)
+        folded.K = k.astype(self.dtype)
+        folded.bias = (mean_y - np.dot(m, mean_y) - np.dot(k, mean_x)).astype(self.dtype)
+        folded.initial_state = mean_y.astype(self.dtype)
+        return folded
+
+    def eval_perf(self, x, y, verbose=True):
+        # x should have shape (time, features) or (time, sequence length, features), contiguous in time
+        # y should have shape (time, out_features)
+        y = self._as_numpy(y)
+        y_pred = self.forward(x)
+
+        # calc performance
+        metrics = RunningMetrics(y.shape[1])
+        metrics.update(y, y_pred)
+        mse, corr = metrics.report(verbose)
+        return y, y_pred, mse, corr
+
+    @staticmethod
+    def _as_numpy(x):
+        return x.numpy() if isinstance(x, torch.Tensor) else np.asarray(x)
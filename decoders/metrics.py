@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class RunningMetrics:
+    """
+    MSE and per-output Pearson correlation between targets and predictions, accumulated batch by batch, so evaluation
+    never needs all predictions at once. Means and (co)variances are merged per batch with the parallel algorithm of
+    Chan et al., which stays accurate where the naive sum-of-squares formula loses precision.
+    """
+    def __init__(self, num_outputs):
+        self.count = 0
+        self.sq_err = np.zeros(num_outputs)
+        self.mean_y = np.zeros(num_outputs)
+        self.mean_p = np.zeros(num_outputs)
+        self.m2_y = np.zeros(num_outputs)      # sum of squared deviations from the mean
+        self.m2_p = np.zeros(num_outputs)
+        self.c_yp = np.zeros(num_outputs)      # sum of products of deviations
+
+    def update(self, y, y_pred):
+        # y & y_pred should have shape (batch, num_outputs)
+        y = np.asarray(y, dtype=np.float64)
+        y_pred = np.asarray(y_pred, dtype=np.float64)
+        n = len(y)
+        if n == 0:
+            return
+        mean_y, mean_p = y.mean(axis=0), y_pred.mean(axis=0)
+        dy, dp = y - mean_y, y_pred - mean_p
+
+        total = self.count + n
+        delta_y, delta_p = mean_y - self.mean_y, mean_p - self.mean_p
+        frac = self.count * n / total
+        self.m2_y += np.sum(dy ** 2, axis=0) + delta_y ** 2 * frac
+        self.m2_p += np.sum(dp ** 2, axis=0) + delta_p ** 2 * frac
+        self.c_yp += np.sum(dy * dp, axis=0) + delta_y * delta_p * frac
+        self.mean_y += delta_y * n / total
+        self.mean_p += delta_p * n / total
+        self.sq_err += np.sum((y - y_pred) ** 2, axis=0)
+        self.count = total
+
+    @property
+    def mse(self):
+        return self.sq_err.sum() / (self.count * len(self.sq_err))
+
+    @property
+    def mse_per_output(self):
+        return self.sq_err / self.count
+
+    @property
+    def corr(self):
+        return self.c_yp / np.sqrt(self.m2_y * self.m2_p)
+
+    def report(self, verbose=True):
+        """Returns (mse, corr), and prints them like the decoders' eval_perf"""
+        mse, corr = self.mse, self.corr
+        if verbose:
+            print(f'avg correlation = {corr.mean()}, mse = {mse}')
+        return mse, corr
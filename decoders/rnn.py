@@ -1,7 +1,16 @@
+import copy
+import os
+import warnings
 import torch
 import torch.nn as nn
 import numpy as np
 
+import data_loading
+from decoders.metrics import RunningMetrics
+
+
+# reduced-precision variants for CPU inference (see to_precision)
+PRECISIONS = ("float32", "int8", "bf16")
 
 # default RNN training params
 RNN_CONFIG = {
@@ -29,22 +38,78 @@ class RNN(nn.Module):
         self.fc = nn.Linear(hidden_size, num_outputs)
         self.hidden = None
         self.is_online = False
+        self.precision = "float32"
+        self.scalers_folded = False     # set on copies made by fold_scalers, which take raw neural data
+        self.val_losses = []        # validation loss per epoch, from the last fit
+        self._step_state = None     # preallocated buffers for `step` (see init_step)
 
     def enable_online(self, is_online=True):
         # when we're running online, save the hidden state in memory rather than resetting it each batch
         self.hidden = self.init_hidden(1) if is_online else None
         self.is_online = is_online
+        if is_online:
+            self.init_step()
+
+    def init_step(self, script=True):
+        """
+        Set up the streaming inference path used by `step`: preallocated hidden state and output buffers, and
+        (with script=True) a TorchScript-traced, frozen single-step cell (rnn + fc) instead of the eager modules.
+        """
+        hidden = self.init_hidden(1)
+        with torch.inference_mode():
+            hidden = tuple(h.clone() for h in hidden) if self.rnn_type == 'lstm' else (hidden.clone(),)
+            out = torch.zeros(self.fc.out_features, device=self.device, dtype=self.compute_dtype)
+            cell = _StepCell(self.rnn, self.fc, self.rnn_type)
+        if script:
+            with torch.no_grad(), warnings.catch_warnings():
+                # newer torch versions deprecate TorchScript in favor of torch.compile, but it's still the lowest
+                # overhead option for a single small step on CPU
+                warnings.simplefilter("ignore", FutureWarning)
+                x = torch.zeros(1, 1, self.rnn.input_size, device=self.device, dtype=self.compute_dtype)
+                cell = torch.jit.freeze(torch.jit.trace(cell, (x,) + hidden).eval())
+        self._step_state = {"hidden": hidden, "out": out, "out_np": np.zeros(self.fc.out_features, dtype=np.float32),
+                            "cell": cell}
+
+    def reset_state(self):
+        """Zero the hidden state used by `step` (e.g. at the start of a trial), in place"""
+        if self._step_state is None:
+            self.init_step()
+        with torch.inference_mode():
+            for h in self._step_state["hidden"]:
+                h.zero_()
+
+    def step(self, x):
+        """
+        Streaming inference for one timestep: x has shape (features,) (numpy or tensor). Runs under inference_mode,
+        carries the hidden state in preallocated buffers, and returns a (num_outputs,) numpy array that is
+        overwritten on the next call.
+        """
+        if self._step_state is None:
+            self.init_step()
+        state = self._step_state
+        with torch.inference_mode():
+            x = torch.as_tensor(x, dtype=self.compute_dtype, device=self.device).reshape(1, 1, -1)
+            out, *hidden = state["cell"](x, *state["hidden"])
+            for h, h_new in zip(state["hidden"], hidden):
+                h.copy_(h_new)
+            if state["out"].is_cuda:
+                state["out"].copy_(out.reshape(-1))
+                out = state["out"].cpu()
+            state["out_np"][:] = out.reshape(-1).float().numpy()
+        return state["out_np"]
 
     def forward(self, x):
         # x should have shape (batches, sequence length, features)
-        x = x.to(self.device)
+        x = x.to(self.device, self.compute_dtype)
         # Pass through the rnn and linear layers:
-        if self.rnn_type == 'lstm':
+        if self.hidden is None:
+            hidden_check = None
+        elif self.rnn_type == 'lstm':
             hidden_check = self.hidden[0]
         else:
             hidden_check = self.hidden
-            
-        if hidden_check.count_nonzero() > 0:
+
+        if hidden_check is not None and hidden_check.count_nonzero() > 0:
             h = self.hidden
         else:
             h = self.init_hidden(x.shape[0]) 
@@ -53,21 +118,104 @@ class RNN(nn.Module):
         out = self.fc(out[:, -1])  # out now has shape (batch_size, num_outs) like (64, 2)
         if self.is_online:
             self.hidden = h
-            return out.cpu().detach().numpy()
+            return out.cpu().detach().float().numpy()
         else:
             return out
 
+    def forward_online(self, x, out):
+        """Single-step forward pass on a (seq_len, features) numpy array, into a preallocated out array"""
+        if len(x) == 1:
+            # the decoder is saved with seq_len = 1, so only the newest bin is new input to the hidden state
+            out[:] = self.step(x[0])
+            return out
+        with torch.no_grad():
+            out[:] = self.forward(torch.from_numpy(x).unsqueeze(0)).reshape(-1)
+        return out
+
+    @property
+    def compute_dtype(self):
+        # dtype of the inputs/activations (int8 dynamic quantization takes float inputs)
+        return torch.bfloat16 if self.precision == "bf16" else torch.float
+
+    def to_precision(self, precision):
+        """
+        A copy of this decoder for reduced-precision CPU inference:
+        - "int8": dynamic quantization, i.e. int8 weights for the LSTM/GRU and fc layers, with activations quantized on
+          the fly (torch doesn't support dynamic quantization of vanilla RNN layers, so only fc is quantized for those)
+        - "bf16": bfloat16 weights and activations
+        - "float32": an unmodified copy
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Invalid precision: {precision}, must be one of {PRECISIONS}")
+        model = copy.deepcopy(self).cpu()
+        model.device = 'cpu'
+        model.precision = precision
+        if precision == "int8":
+            with warnings.catch_warnings():
+                # newer torch versions deprecate the quantized tensor API (but keep supporting it)
+                warnings.simplefilter("ignore", (UserWarning, FutureWarning, DeprecationWarning))
+                model = torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+        elif precision == "bf16":
+            model = model.to(torch.bfloat16)
+        return model
+
+    def fold_scalers(self, neural_scaler, output_scaler):
+        """
+        A copy of this decoder that works on raw (unnormalized) neural data and outputs unnormalized predictions.
+        The neural scaler is folded into the first layer's input weights/bias (W_ih' = W_ih / s_x,
+        b_ih' = b_ih - W_ih (mu_x / s_x)) and the output scaler into fc (W' = diag(s_y) W, b' = s_y b + mu_y).
+        Note that a zero history bin in normalized units corresponds to mu_x in raw units.
+
+        Reduced-precision decoders must be converted after folding (see main_export_decoder.py), and a decoder that
+        already has its scalers folded in is returned as an unchanged copy.
+        """
+        if self.scalers_folded:
+            return copy.deepcopy(self)
+        if self.precision != "float32":
+            raise ValueError(f"Can't fold scalers into a {self.precision} decoder - fold them before to_precision")
+        mean_x, scale_x = data_loading.scaler_affine(neural_scaler, self.rnn.input_size)
+        mean_y, scale_y = data_loading.scaler_affine(output_scaler, self.fc.out_features)
+        folded = copy.deepcopy(self)
+        folded.scalers_folded = True
+        with torch.no_grad():
+            w_ih, b_ih = folded.rnn.weight_ih_l0, folded.rnn.bias_ih_l0
+            mean_x, scale_x = (torch.tensor(v, dtype=w_ih.dtype, device=w_ih.device) for v in (mean_x, scale_x))
+            b_ih -= w_ih @ (mean_x / scale_x)
+            w_ih /= scale_x
+            mean_y, scale_y = (torch.tensor(v, dtype=w_ih.dtype, device=w_ih.device) for v in (mean_y, scale_y))
+            folded.fc.weight *= scale_y[:, None]
+            folded.fc.bias *= scale_y
+            folded.fc.bias += mean_y
+        return folded
+
+    def __getstate__(self):
+        # traced cells can't be pickled (or deep-copied), they're rebuilt by init_step
+        state = self.__dict__.copy()
+        state["_step_state"] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("_step_state", None)
+        state.setdefault("precision", "float32")
+        state.setdefault("scalers_folded", False)
+        state.setdefault("val_losses", [])
+        super().__setstate__(state)
+
     def init_hidden(self, batch_size):
+        dtype = self.compute_dtype
         if self.rnn_type == 'lstm':
-            return (torch.zeros(self.num_layers, batch_size, self.hidden_size).to(device=self.device),
-                    torch.zeros(self.num_layers, batch_size, self.hidden_size).to(device=self.device))
+            return (torch.zeros(self.num_layers, batch_size, self.hidden_size, dtype=dtype).to(device=self.device),
+                    torch.zeros(self.num_layers, batch_size, self.hidden_size, dtype=dtype).to(device=self.device))
         else:
-            return torch.zeros(self.num_layers, batch_size, self.hidden_size).to(device=self.device)
+            return torch.zeros(self.num_layers, batch_size, self.hidden_size, dtype=dtype).to(device=self.device)
 
-    def fit(self, dataloader, optimizer, loss_fn, epochs, verbose=True):
-        self.train()
-        epoch_losses = []
-        for i in range(epochs):
+    def fit(self, dataloader, optimizer, loss_fn, epochs, verbose=True, val_loader=None, **train_kwargs):
+        """
+        Train on (windowed) batches from dataloader. With val_loader, the validation loss is computed every epoch and
+        used for early stopping; see `train_epochs` for the early stopping & checkpointing options (patience,
+        checkpoint_path, checkpoint_every, resume).
+        """
+        def train_epoch():
             losses = []
             for x, y in dataloader:
                 x, y = x.to(self.device), y.to(self.device)
@@ -77,26 +225,179 @@ class RNN(nn.Module):
                 loss.backward()
                 optimizer.step()
                 losses.append(loss.item())
-            epoch_losses.append(np.mean(losses))
+            return np.mean(losses)
+
+        def val_loss():
+            self.eval()
+            total, count = 0.0, 0
+            with torch.inference_mode():
+                for x, y in val_loader:
+                    x, y = x.to(self.device), y.to(self.device)
+                    total += loss_fn(self.forward(x), y).item() * len(y)
+                    count += len(y)
+            return total / count
+
+        return self.train_epochs(train_epoch, optimizer, epochs, val_loss if val_loader is not None else None,
+                                 verbose=verbose, **train_kwargs)
+
+    def fit_tbptt(self, chunks, optimizer, loss_fn, epochs, verbose=True, val_data=None, **train_kwargs):
+        """
+        Train statefully with truncated backprop through time, on contiguous chunks from data_loading.ContiguousChunks.
+        The hidden state is carried across chunks (detached, so gradients only flow within a chunk) and the loss is
+        taken at every timestep, matching how the decoder runs online: one bin at a time with a persistent state.
+        val_data is an optional (x, y) tuple of contiguous validation data, which is decoded statefully each epoch.
+        """
+        def train_epoch():
+            losses = []
+            h = None
+            for x, y, is_first in chunks:
+                x, y = x.to(self.device), y.to(self.device)
+                if is_first:
+                    h = self.init_hidden(x.shape[0])
+                else:
+                    h = tuple(t.detach() for t in h) if self.rnn_type == 'lstm' else h.detach()
+                optimizer.zero_grad()
+                out, h = self.rnn(x, h)
+                loss = loss_fn(self.fc(out), y)
+                loss.backward()
+                optimizer.step()
+                losses.append(loss.item())
+            return np.mean(losses)
+
+        def val_loss():
+            x, y = val_data
+            y_pred = self.predict_sequence(x)
+            return loss_fn(torch.from_numpy(y_pred), torch.tensor(y, dtype=torch.float)).item()
+
+        return self.train_epochs(train_epoch, optimizer, epochs, val_loss if val_data is not None else None,
+                                 verbose=verbose, **train_kwargs)
+
+    def train_epochs(self, train_epoch, optimizer, epochs, val_loss=None, patience=None, checkpoint_path=None,
+                     checkpoint_every=1, resume=False, verbose=True):
+        """
+        Epoch loop shared by fit & fit_tbptt, with early stopping and checkpointing.
+
+        Parameters:
+        - train_epoch: function that trains for one epoch and returns the mean training loss.
+        - val_loss: optional function returning the validation loss. If given, the weights with the lowest validation
+          loss are restored at the end, and with `patience` training stops after that many epochs without improvement.
+        - checkpoint_path: if given, the model, optimizer, RNG and early stopping state are saved there every
+          `checkpoint_every` epochs (and when training stops), replacing the previous checkpoint atomically.
+        - resume: continue from the checkpoint at checkpoint_path, if there is one.
+
+        Returns:
+        - list of the mean training loss per epoch (including epochs before resuming).
+        """
+        state = {"epoch": 0, "epoch_losses": [], "val_losses": [], "best_val": np.inf, "best_state": None,
+                 "epochs_since_best": 0}
+        if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+            # load on the CPU (the RNG state must be a CPU tensor); load_state_dict moves the weights to the device
+            checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+            self.load_state_dict(checkpoint["model"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            torch.set_rng_state(checkpoint["torch_rng"])
+            np.random.set_state(checkpoint["numpy_rng"])
+            state = checkpoint["train_state"]
+            print(f"Resuming training from {checkpoint_path} at epoch {state['epoch']}")
+
+        for i in range(state["epoch"], epochs):
+            self.train()
+            state["epoch_losses"].append(train_epoch())
+            msg = f'epoch {i}, training loss = {state["epoch_losses"][-1]}'
+            if val_loss is not None:
+                state["val_losses"].append(val_loss())
+                msg += f', validation loss = {state["val_losses"][-1]}'
+                if state["val_losses"][-1] < state["best_val"]:
+                    state["best_val"] = state["val_losses"][-1]
+                    state["best_state"] = copy.deepcopy(self.state_dict())
+                    state["epochs_since_best"] = 0
+                else:
+                    state["epochs_since_best"] += 1
+            state["epoch"] = i + 1
             if verbose:
-                print(f'epoch {i}, training loss = {np.mean(losses)}')
-        return epoch_losses
+                print(msg)
 
-    def eval_perf(self, dataloader, verbose=True):
+            stop = patience is not None and state["epochs_since_best"] >= patience
+            if checkpoint_path is not None and (state["epoch"] % checkpoint_every == 0 or stop or i == epochs - 1):
+                self.save_checkpoint(checkpoint_path, optimizer, state)
+            if stop:
+                print(f"Stopping early: no improvement in validation loss for {patience} epochs")
+                break
+
+        if state["best_state"] is not None:
+            self.load_state_dict(state["best_state"])
+            if verbose:
+                print(f'Restored the best weights (validation loss = {state["best_val"]})')
+        self.val_losses = state["val_losses"]
+        return state["epoch_losses"]
+
+    def save_checkpoint(self, path, optimizer, train_state):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        torch.save({"model": self.state_dict(), "optimizer": optimizer.state_dict(), "train_state": train_state,
+                    "torch_rng": torch.get_rng_state(), "numpy_rng": np.random.get_state()}, tmp_path)
+        os.replace(tmp_path, path)
+
+    def predict_sequence(self, x, chunk_len=1000):
+        """Run statefully over a whole contiguous recording of shape (time, features), like online decoding"""
         self.eval()
-        # get model predictions
-        all_y, all_yhat = [], []
-        for x, y in dataloader:
-            x, y = x.to(self.device), y.to(self.device)
-            yhat = self.forward(x)
-            all_y.append(y.cpu().detach().numpy())
-            all_yhat.append(yhat.cpu().detach().numpy())
-        all_y = np.array(all_y).squeeze(0)
-        all_yhat = np.array(all_yhat).squeeze(0)
+        x = x.numpy() if isinstance(x, torch.Tensor) else np.asarray(x)
+        y_pred = []
+        h = self.init_hidden(1)
+        with torch.inference_mode():
+            for start in range(0, len(x), chunk_len):
+                xc = torch.from_numpy(x[start:start + chunk_len].astype(np.float32)).unsqueeze(0)
+                out, h = self.rnn(xc.to(self.device, self.compute_dtype), h)
+                y_pred.append(self.fc(out[0]).cpu().float().numpy())
+        return np.concatenate(y_pred)
+
+    def eval_perf_sequence(self, x, y, verbose=True):
+        """Like eval_perf, but decoding the contiguous test data statefully (see predict_sequence)"""
+        y = y.numpy() if isinstance(y, torch.Tensor) else np.asarray(y)
+        y_pred = self.predict_sequence(x)
 
         # calc performance
-        mse = (np.square(all_y - all_yhat)).mean()
-        corr = np.diag(np.corrcoef(all_y, all_yhat, rowvar=False)[:y.shape[1], y.shape[1]:])
-        if verbose:
-            print(f'avg correlation = {corr.mean()}, mse = {mse}')
-        return all_y, all_yhat, mse, corr
+        metrics = RunningMetrics(y.shape[1])
+        metrics.update(y, y_pred)
+        mse, corr = metrics.report(verbose)
+        return y, y_pred, mse, corr
+
+    def eval_perf(self, dataloader, verbose=True, return_predictions=True):
+        """
+        Evaluate batch by batch under inference_mode, accumulating MSE & correlation with running sums, so peak memory
+        depends on the batch size rather than the test set size. With return_predictions=False the targets and
+        predictions aren't kept, and (None, None, mse, corr) is returned.
+        """
+        self.eval()
+        metrics = RunningMetrics(self.fc.out_features)
+        all_y, all_yhat = [], []
+        with torch.inference_mode():
+            for x, y in dataloader:
+                yhat = self.forward(x.to(self.device)).float().cpu().numpy()
+                y = y.cpu().numpy()
+                metrics.update(y, yhat)
+                if return_predictions:
+                    all_y.append(y)
+                    all_yhat.append(yhat)
+
+        mse, corr = metrics.report(verbose)
+        if not return_predictions:
+            return None, None, mse, corr
+        return np.concatenate(all_y), np.concatenate(all_yhat), mse, corr
+
+
+class _StepCell(nn.Module):
+    """One timestep of the rnn followed by the fc layer, with the hidden state passed explicitly (for tracing)"""
+
+    def __init__(self, rnn, fc, rnn_type):
+        super().__init__()
+        self.rnn = rnn
+        self.fc = fc
+        self.is_lstm = rnn_type == 'lstm'
+
+    def forward(self, x, h, c=None):
+        if self.is_lstm:
+            out, (h, c) = self.rnn(x, (h, c))
+            return self.fc(out[:, -1]), h, c
+        out, h = self.rnn(x, h)
+        return self.fc(out[:, -1]), h
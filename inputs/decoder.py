@@ -1,6 +1,9 @@
+import queue
+import threading
+import time
 import numpy as np
-import torch
-from collections import deque
+
+import data_loading
 
 
 class RealTimeDecoder:
@@ -10,11 +13,14 @@ class RealTimeDecoder:
     and updates position by integrating velocity.
 
     The `model` should output both positions and velocities (e.g. [pos1 pos2 vel1 vel2])
+
+    The scalers are folded into a copy of the model (see the decoders' `fold_scalers`), which runs on the raw neural
+    history and outputs unnormalized pos/vel, so each frame is one forward pass on preallocated buffers with no
+    sklearn calls or tensor construction.
     """
     def __init__(self, num_dof, model, neuralsim, neural_scaler, output_scaler, seq_len, integration_beta=0.98):
         self.num_dof = num_dof
         self.model = model
-        self.model.enable_online(True)
         self.neuralsim = neuralsim
         self.neural_scaler = neural_scaler
         self.output_scaler = output_scaler
@@ -24,41 +30,148 @@ class RealTimeDecoder:
               f"{100 - integration_beta * 100:.1f}% decoded position")
         print(f"Neural simulator: {self.neuralsim.num_chans} chans with {self.neuralsim.noise_level} noise level")
 
-        # setup neural history & init with zeros
+        # decoder with the scalers folded in, and their parameters (for recalibration & plotting)
         num_chans = neuralsim.num_chans
-        self.neural_history = deque(maxlen=seq_len)
-        for _ in range(seq_len):
-            self.neural_history.append(np.zeros((num_chans,)))
+        self.online_model = self.model.fold_scalers(neural_scaler, output_scaler)
+        self.online_model.enable_online(True)
+        self.neural_mean, self.neural_scale = data_loading.scaler_affine(neural_scaler, num_chans)
+        self.output_mean, self.output_scale = data_loading.scaler_affine(output_scaler, 2 * num_dof)
 
+        # raw neural history, init with the channel means (i.e. zeros after normalization). This is a ring buffer of
+        # twice the length: each new bin is written at row head + seq_len and mirrored to row head, so the newest
+        # seq_len bins are always the contiguous view buffer[head + 1:head + 1 + seq_len]. The row & window views are
+        # created once here, so a frame only writes one bin (plus its mirror) and allocates nothing
+        dtype = getattr(self.online_model, "dtype", np.float32)
+        self._buffer = np.empty((2 * seq_len, num_chans), dtype=dtype)
+        self._buffer[:] = self.neural_mean
+        self._rows = list(self._buffer)
+        self._windows = [self._buffer[i + 1:i + 1 + seq_len] for i in range(seq_len)]
+        self._recent = [self._buffer[i + seq_len] for i in range(seq_len)]      # read-only, for get_recent_neural
+        for recent in self._recent:
+            recent.flags.writeable = False
+        self._head = seq_len - 1
+        self._decoded = np.zeros((2 * num_dof,), dtype=dtype)
+        self._decoded_pos, self._decoded_vel = self._decoded[:num_dof], self._decoded[num_dof:]
+
+        # positions are updated in place, so a frame allocates no arrays
         self.prev_desired_pos = 0.5 * np.ones((num_dof,))
         self.prev_actual_pos = 0.5 * np.ones((num_dof,))
+        self._desired_vel = np.zeros((num_dof,))
+        self._pos_term = np.zeros((num_dof,))
+
+        # most recent raw neural bin and decoder output (e.g. for the session log)
+        self.last_neural = np.zeros((num_chans,))
+        self.last_decoded_posvel = self._decoded
+
+        # online recalibration (see enable_recalibration)
+        self.recalibrating = False
+        self._rls_queue = None
+        self._rls_thread = None
+        self.rls_update_times = []
+        self.rls_num_dropped = 0
+
+    def enable_recalibration(self, forgetting_factor=0.995, prior_samples=1000, background=True):
+        """
+        Recalibrate the decoder while online with recursive least squares, using the user's intended position/velocity
+        (the `desired_pos` passed to decode) as the target for each frame's neural history. Only ridge decoders support
+        this. With background=True updates run on a worker thread, so the frame loop is never blocked: if the worker is
+        still busy with earlier frames, new samples are dropped (counted in rls_num_dropped) rather than queued up.
+        """
+        if not hasattr(self.model, "rls_update"):
+            raise ValueError(f"{type(self.model).__name__} doesn't support online recalibration")
+        self.model.init_rls(forgetting_factor=forgetting_factor, prior_samples=prior_samples)
+        self.recalibrating = True
+        print(f"Recalibrating online with RLS (forgetting factor {forgetting_factor})")
+        if background and self._rls_thread is None:
+            self._rls_queue = queue.Queue(maxsize=2)
+            self._rls_thread = threading.Thread(target=self._rls_loop, daemon=True)
+            self._rls_thread.start()
+
+    @property
+    def neural_history(self):
+        """The raw neural history of shape (seq_len, num_chans), oldest bin first (a view, updated in place)"""
+        return self._windows[self._head]
+
+    def normalize_neural(self, neural):
+        """Raw neural data in the decoder's normalized units, as a new array"""
+        return (neural - self.neural_mean) / self.neural_scale
+
+    def _recalibrate(self, neural_history, desired_pos, desired_vel):
+        # the model is fit in normalized units (this also copies the history, which is overwritten next frame)
+        neural_history = self.normalize_neural(neural_history)
+        target = (np.concatenate([desired_pos, desired_vel]) - self.output_mean) / self.output_scale
+        if self._rls_queue is None:
+            self._rls_step(neural_history, target)
+            return
+        try:
+            self._rls_queue.put_nowait((neural_history, target))
+        except queue.Full:
+            self.rls_num_dropped += 1
+
+    def _rls_step(self, x, y):
+        start = time.perf_counter()
+        self.model.rls_update(x, y)
+        self.online_model = self.model.fold_scalers(self.neural_scaler, self.output_scaler)
+        self.rls_update_times.append(time.perf_counter() - start)
+
+    def _rls_loop(self):
+        # runs on the background thread
+        while True:
+            x, y = self._rls_queue.get()
+            try:
+                if self.recalibrating:
+                    self._rls_step(x, y)
+            except Exception as e:
+                # keep decoding with the last good model rather than letting the thread die silently
+                self.recalibrating = False
+                print(f"RLS update failed, recalibration turned off: {type(e).__name__}: {e}")
+            finally:
+                self._rls_queue.task_done()
+
+    def recalibration_report(self):
+        """Summary of the cost of the RLS updates so far"""
+        if not self.rls_update_times:
+            return "RLS: no updates"
+        times_us = 1e6 * np.array(self.rls_update_times)
+        return (f"RLS: {len(times_us)} updates ({self.rls_num_dropped} dropped), per-update cost "
+                f"mean {times_us.mean():.0f} us, p50 {np.percentile(times_us, 50):.0f} us, "
+                f"p99 {np.percentile(times_us, 99):.0f} us, max {times_us.max():.0f} us")
 
     def decode(self, desired_pos):
-        # generate neural data
-        desired_vel = desired_pos - self.prev_desired_pos
-        neural = self.neuralsim.generate(pos=desired_pos, vel=desired_vel)
-        neural = self.neural_scaler.transform(neural.reshape(1, -1))
-        self.neural_history.append(neural.reshape(-1))
-        neural_history_np = np.array(self.neural_history)
-        self.prev_desired_pos = desired_pos
-
-        # decode (model expects shape (batch_size, seq_len, num_chans))
-        neural_tensor = torch.Tensor(neural_history_np).reshape((1, self.seq_len, -1))
-        decoded_posvel = self.model(neural_tensor).reshape(-1) #crash if not lstm
-        decoded_posvel = self.output_scaler.inverse_transform(decoded_posvel.reshape(1, -1)).reshape(-1)
-        pos = decoded_posvel[:self.num_dof]
-        vel = decoded_posvel[self.num_dof:]
-
-        # integrate velocity and clip position to [0, 1]
-        new_pos = self.integration_beta * (self.prev_actual_pos + vel) + (1 - self.integration_beta) * pos
-        new_pos = np.clip(new_pos, 0, 1)
-        self.prev_actual_pos = new_pos
-        
+        """
+        Decode one frame, returning the new position. The returned array is the decoder's position buffer, which is
+        updated in place on the next frame, so copy it to keep it
+        """
+        # generate neural data straight into the newest history bin, and mirror it
+        desired_vel = np.subtract(desired_pos, self.prev_desired_pos, out=self._desired_vel)
+        self._head = (self._head + 1) % self.seq_len
+        newest = self._rows[self._head + self.seq_len]
+        self.last_neural = self.neuralsim.generate_one(pos=desired_pos, vel=desired_vel, out=newest)
+        np.copyto(self._rows[self._head], newest)
+        np.copyto(self.prev_desired_pos, desired_pos)
+        if self.recalibrating:
+            self._recalibrate(self.neural_history, desired_pos, desired_vel)
+
+        # decode (one forward pass on the raw (seq_len, num_chans) history, into a preallocated buffer)
+        decoded_posvel = self.online_model.forward_online(self.neural_history, out=self._decoded)
+        self.last_decoded_posvel = decoded_posvel
+
+        # integrate velocity and clip position to [0, 1]: beta * (prev_pos + vel) + (1 - beta) * pos
+        new_pos = self.prev_actual_pos
+        np.add(new_pos, self._decoded_vel, out=new_pos)
+        np.multiply(new_pos, self.integration_beta, out=new_pos)
+        np.multiply(self._decoded_pos, 1 - self.integration_beta, out=self._pos_term)
+        np.add(new_pos, self._pos_term, out=new_pos)
+        np.clip(new_pos, 0, 1, out=new_pos)
         return new_pos
 
     def set_position(self, pos):
-        self.prev_desired_pos = pos
-        self.prev_actual_pos = pos
+        np.copyto(self.prev_desired_pos, pos)
+        np.copyto(self.prev_actual_pos, pos)
 
     def get_recent_neural(self):
-        return self.neural_history[-1]
+        """
+        The most recent raw neural bin, as a read-only view into the history buffer. It's overwritten as new bins
+        arrive, so copy it (e.g. with normalize_neural) to keep it
+        """
+        return self._recent[self._head]
@@ -0,0 +1,35 @@
+import argparse
+
+from data_catalog import DatasetCatalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List and filter the recorded movement datasets")
+    parser.add_argument("--data_dir", default=None, help="Folder of movement datasets (default data/movedata)")
+    parser.add_argument("--scan", action="store_true",
+                        help="Re-index the folder first (only new or changed datasets are read).")
+    parser.add_argument("--dof", type=int, default=None, help="Only datasets with this many DoF.")
+    parser.add_argument("--online", dest="online", action="store_true", default=None,
+                        help="Only sessions with online (decoder-controlled) frames.")
+    parser.add_argument("--offline", dest="online", action="store_false",
+                        help="Only fully offline sessions.")
+    parser.add_argument("--min_duration", type=float, default=None, help="Minimum duration in seconds.")
+    parser.add_argument("--max_duration", type=float, default=None, help="Maximum duration in seconds.")
+    parser.add_argument("-p", "--pattern", default=None, help="Glob on the file name, e.g. 'dataset_2023*'.")
+    args = parser.parse_args()
+
+    catalog = DatasetCatalog() if args.data_dir is None else DatasetCatalog(args.data_dir)
+    if args.scan or not catalog.entries:
+        catalog.scan(verbose=True)
+
+    entries = catalog.query(num_dof=args.dof, online=args.online, min_duration=args.min_duration,
+                            max_duration=args.max_duration, pattern=args.pattern)
+    print(f"{'name':<45} {'dof':>4} {'samples':>8} {'secs':>8} {'trials':>7} {'online':>7}")
+    for e in entries:
+        print(f"{e['name']:<45} {e['num_dof']:>4} {e['num_samples']:>8} {e['duration_s']:>8.1f} "
+              f"{e['num_trials']:>7} {e['online_frac']:>6.0%}")
+    print(f"{len(entries)} datasets, {sum(e['duration_s'] for e in entries):.1f} seconds total")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,24 @@ import os
 import pickle
 
 
-def create_fakebrain(num_chans, num_dof, neural_noise):
-    return neuralsim.LogLinUnitGenerator(num_chans,
-                                         num_dof,
-                                         pos_mult=0.5,              # put less emphasis on position
-                                         vel_mult=2,                # put more emphasis on velocity
-                                         noise_level=neural_noise)
+def create_fakebrain(num_chans, num_dof, neural_noise, model="loglin", dtype="float64", tuned_frac=1.0):
+    if model == "loglin":
+        generator = neuralsim.LogLinUnitGenerator
+    elif model == "poisson":
+        generator = neuralsim.PoissonSpikeGenerator
+    elif model == "broadband":
+        # simulate 30 kHz voltage from log-linear rates, then bin threshold crossings
+        return neuralsim.BroadbandSimulator(create_fakebrain(num_chans, num_dof, neural_noise, "loglin",
+                                                             dtype, tuned_frac))
+    else:
+        raise ValueError(f"Invalid fake brain model: {model}")
+    return generator(num_chans,
+                     num_dof,
+                     pos_mult=0.5,              # put less emphasis on position
+                     vel_mult=2,                # put more emphasis on velocity
+                     noise_level=neural_noise,
+                     dtype=dtype,
+                     tuned_frac=tuned_frac)
 
 
 def save_fakebrain(fakebrain, num_chans, num_dof, save_name):
@@ -25,10 +37,21 @@ def save_fakebrain(fakebrain, num_chans, num_dof, save_name):
 def main():
     # parse arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument('-c', '--num_chans', type=int, default=100)
-    parser.add_argument('-n', '--neural_noise_level', type=float, default=0.2)
+    parser.add_argument('-c', '--num_chans', type=int, nargs='+', default=[100],
+                        help="Number of channels (with --num_brains, one value per brain or a single shared value)")
+    parser.add_argument('-n', '--neural_noise_level', type=float, nargs='+', default=[0.2],
+                        help="Noise level (with --num_brains, one value per brain or a single shared value)")
+    parser.add_argument('-k', '--num_brains', type=int, default=1,
+                        help="Create a bank of fake brains at once (loglin only), saved as <save_name>_<i>.pkl")
     parser.add_argument("-t", "--task", default="cursor", choices=["cursor", "hand"],
                         help="Task choice: cursor or hand.")
+    parser.add_argument("-m", "--model", default="loglin", choices=["loglin", "poisson", "broadband"],
+                        help="Neural simulator: loglin (bin-level gaussian noise), poisson (spike-level), or "
+                             "broadband (30 kHz voltage with threshold crossings).")
+    parser.add_argument("--dtype", default="float64", choices=["float64", "float32"],
+                        help="Precision of the simulated data (float32 for high channel counts).")
+    parser.add_argument("--tuned_frac", type=float, default=1.0,
+                        help="Fraction of channels tuned to movement (the rest only fire at their baseline rate).")
     parser.add_argument('-o', '--save_name', type=str, default=None)
     args = parser.parse_args()
 
@@ -40,13 +63,27 @@ def main():
     elif args.task == "hand":
         num_dof = 5
 
-    print(f"\nCreating fake brain with {args.num_chans} channels, noise level {args.neural_noise_level}, and {num_dof} DoF")
+    if args.num_brains > 1:
+        if args.model != "loglin":
+            raise ValueError("--num_brains is only supported for the loglin model")
+        print(f"\nCreating {args.num_brains} fake brains with {args.num_chans} channels, "
+              f"noise levels {args.neural_noise_level}, and {num_dof} DoF")
+        bank = neuralsim.BrainBank.create(args.num_brains, args.num_chans, num_dof, args.neural_noise_level,
+                                          pos_mult=0.5, vel_mult=2, dtype=args.dtype, tuned_frac=args.tuned_frac)
+        save_name = args.save_name[:-4] if args.save_name.endswith(".pkl") else args.save_name
+        for i, fakebrain in enumerate(bank.brains()):
+            save_fakebrain(fakebrain, fakebrain.num_chans, num_dof, f"{save_name}_{i:02d}")
+        return
+
+    num_chans, noise_level = args.num_chans[0], args.neural_noise_level[0]
+    print(f"\nCreating {args.model} fake brain with {num_chans} channels, noise level {noise_level}, "
+          f"and {num_dof} DoF")
 
     # create fakebrain
-    fakebrain = create_fakebrain(args.num_chans, num_dof, args.neural_noise_level)
+    fakebrain = create_fakebrain(num_chans, num_dof, noise_level, args.model, args.dtype, args.tuned_frac)
 
     # save fakebrain
-    save_fakebrain(fakebrain, args.num_chans, num_dof, args.save_name)
+    save_fakebrain(fakebrain, num_chans, num_dof, args.save_name)
 
 
 if __name__ == "__main__":
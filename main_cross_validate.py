@@ -0,0 +1,71 @@
+import argparse
+import os
+import pandas as pd
+
+import decoders.rnn
+import training
+
+
+def cv_report(fold_metrics, num_dof):
+    """Table with one row per fold plus the mean over folds: corr & mse overall and for each output"""
+    names = [f"{pvtype}{i}" for pvtype in ("pos", "vel") for i in range(num_dof)]
+    rows = []
+    for i, metrics in enumerate(fold_metrics):
+        row = {"fold": str(i + 1), "samples": metrics.count, "corr": metrics.corr.mean(), "mse": metrics.mse}
+        row.update({f"corr_{name}": corr for name, corr in zip(names, metrics.corr)})
+        row.update({f"mse_{name}": mse for name, mse in zip(names, metrics.mse_per_output)})
+        rows.append(row)
+    report = pd.DataFrame(rows)
+    mean = report.drop(columns=["fold", "samples"]).mean()
+    report.loc[len(report)] = {"fold": "mean", "samples": report["samples"].sum(), **mean}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Blocked k-fold cross-validation of a decoder over a whole recording")
+    parser.add_argument("-d", "--dataset", default="dataset_20231012_250sec_random.pkl")
+    parser.add_argument("-fb", "--fake_brain", required=True)
+    parser.add_argument("--decoder_type", default="ridge", choices=training.DECODER_TYPES)
+    parser.add_argument("--rnn_type", default="rnn", choices=["rnn", "gru", "lstm"])
+    parser.add_argument("--hidden_size", type=int, default=decoders.rnn.RNN_CONFIG["hidden_size"])
+    parser.add_argument("--seq_len", type=int, default=20)
+    parser.add_argument("--lmbda", type=float, default=0.1, help="Ridge regularization strength")
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--tbptt", action="store_true", help="Train RNNs with truncated backprop (see main_train_decoder)")
+    parser.add_argument("--patience", type=int, default=5)
+    parser.add_argument("-k", "--num_folds", type=int, default=5)
+    parser.add_argument("--gap", type=int, default=None,
+                        help="Samples left out of training on either side of each held-out fold (default seq_len)")
+    parser.add_argument("--val_frac", type=float, default=0.1,
+                        help="Fraction of each fold's training data held out for RNN early stopping")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for simulating the neural data")
+    parser.add_argument("--no_cache", action="store_true", help="Don't read/write the simulated data cache")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Folds trained in parallel (default: one per fold, up to half the cores; unused for ridge)")
+    parser.add_argument("-t", "--threads_per_worker", type=int, default=1, help="torch/BLAS threads per worker")
+    parser.add_argument("-o", "--output", default=None, help="Optionally save the report as a CSV")
+    args = parser.parse_args()
+
+    fake_brain = training.load_fakebrain(args.fake_brain)
+    workers = args.workers or max(1, min(args.num_folds, (os.cpu_count() or 1) // 2))
+    fold_metrics = training.cross_validate(args.dataset, fake_brain, decoder_type=args.decoder_type,
+                                           num_folds=args.num_folds, gap=args.gap, seq_len=args.seq_len,
+                                           lmbda=args.lmbda, val_frac=args.val_frac, seed=args.seed, workers=workers,
+                                           threads_per_worker=args.threads_per_worker, use_cache=not args.no_cache,
+                                           verbose=False, rnn_type=args.rnn_type, hidden_size=args.hidden_size,
+                                           epochs=args.epochs, batch_size=args.batch_size, tbptt=args.tbptt,
+                                           patience=args.patience)
+
+    report = cv_report(fold_metrics, fake_brain.num_dof)
+    print(f"{args.num_folds}-fold blocked cross-validation of {args.decoder_type} on {args.dataset} "
+          f"(corr & mse in units normalized by each fold's training data)")
+    with pd.option_context("display.max_columns", None, "display.width", 200, "display.precision", 4):
+        print(report.to_string(index=False))
+    if args.output is not None:
+        report.to_csv(args.output, index=False)
+        print(f"Saved report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import os
+import pickle
+import numpy as np
+
+import training
+from benchmarks.bench_rnn import step_latencies
+from decoders.metrics import RunningMetrics
+from decoders.rnn import PRECISIONS
+
+
+def load_test_data(dataset_fname, fake_brain, seed=0, train_data_frac=0.8):
+    """
+    Raw (unnormalized) neural data & pos/vel for the held-out split that main_train_decoder.py used with the same
+    dataset/seed/train_data_frac (from the data cache if it's there, otherwise re-simulated). The split is
+    unnormalized with its own scalers, since it was normalized with those rather than the decoder's.
+    """
+    data = training.prepare_data(dataset_fname, fake_brain, seed=seed, train_data_frac=train_data_frac,
+                                 verbose=False)
+    x_test = data.neural_scaler.inverse_transform(data.x_test_norm)
+    return x_test, data.output_scaler.inverse_transform(data.y_test_norm)
+
+
+def evaluate(online_model, x_test, y_test, output_scaler, num_steps=1000):
+    """corr/mse (in normalized units, as reported by eval_perf) and per-step latency of a folded decoder"""
+    y_pred = online_model.predict_sequence(x_test)
+    metrics = RunningMetrics(y_test.shape[1])
+    metrics.update(output_scaler.transform(y_test), output_scaler.transform(y_pred))
+    mse, corr = metrics.report(verbose=False)
+
+    online_model.init_step()
+    latencies = step_latencies(online_model.step, x_test[:num_steps].astype(np.float32))
+    return corr.mean(), mse, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export reduced-precision (int8 / bfloat16) variants of an RNN decoder")
+    parser.add_argument("-d", "--decoder", required=True, help="Name of the trained RNN decoder file (e.g. handrnn).")
+    parser.add_argument("-p", "--precision", nargs='+', default=["int8", "bf16"], choices=PRECISIONS[1:],
+                        help="Precisions to export.")
+    parser.add_argument("--dataset", default="dataset_20231012_250sec_random.pkl",
+                        help="Movement dataset the decoder was trained on, for the accuracy comparison.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed used to simulate the training data.")
+    parser.add_argument("--train_data_frac", type=float, default=0.8)
+    parser.add_argument("--no_save", action="store_true", help="Only report accuracy & latency.")
+    args = parser.parse_args()
+
+    decoder_name = args.decoder[:-4] if args.decoder.endswith(".pkl") else args.decoder
+    with open(os.path.join(training.DECODER_DIR, f"{decoder_name}.pkl"), "rb") as f:
+        model, fake_brain, neural_scaler, output_scaler, seq_len = pickle.load(f)
+    if not hasattr(model, "to_precision"):
+        raise ValueError(f"Only RNN decoders can be exported, not {type(model).__name__}")
+
+    x_test, y_test = load_test_data(args.dataset, fake_brain, args.seed, args.train_data_frac)
+    print(f"Evaluating {decoder_name} ({model.rnn_type}, hidden size {model.hidden_size}) on {len(x_test)} test samples")
+
+    # evaluate each variant exactly as RealTimeDecoder runs it: scalers folded in, then converted, stepping one bin
+    print(f"{'precision':>10} {'corr':>8} {'mse':>8} {'p50 step':>10} {'p99 step':>10} {'speedup':>8}")
+    baseline = None
+    folded = model.fold_scalers(neural_scaler, output_scaler)
+    for precision in ["float32"] + args.precision:
+        # the scalers are folded in at full precision, then the weights are converted (so the exported decoder
+        # takes raw neural data, and RealTimeDecoder uses it as is)
+        exported = folded.to_precision(precision)
+        corr, mse, p50, p99 = evaluate(exported, x_test, y_test, output_scaler)
+        baseline = baseline or (corr, mse, p50)
+        print(f"{precision:>10} {corr:>8.4f} {mse:>8.4f} {p50:>7.0f} us {p99:>7.0f} us {baseline[2] / p50:>7.2f}x")
+        if precision != "float32":
+            print(f"{'':>10} {corr - baseline[0]:>+8.4f} {mse - baseline[1]:>+8.4f}")
+
+        if precision != "float32" and not args.no_save:
+            save_name = f"{decoder_name}_{precision}.pkl"
+            with open(os.path.join(training.DECODER_DIR, save_name), "wb") as f:
+                pickle.dump((exported, fake_brain, neural_scaler, output_scaler, seq_len), f)
+            print(f"{'':>10} saved to {save_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import argparse
 import pickle
 from data_recorder import DataRecorder
 from inputs.decoder import RealTimeDecoder
+from session_log import SessionLog
 
 
 def load_decoder(decoder_name, num_dof, integration_beta):
@@ -47,6 +48,12 @@ def main():
     # add argument for the decoder integration beta
     parser.add_argument("-b", "--integration_beta", default=0.98, type=float,
                         help="Integration beta: the percentage of decoded position that is integrated velocity.")
+    parser.add_argument("-log", "--log_session", action="store_true",
+                        help="Log every frame (including neural data & decoder outputs) to data/sessions.")
+    parser.add_argument("-rc", "--recalibrate", action="store_true",
+                        help="Recalibrate the (ridge) decoder online with recursive least squares while it's in control.")
+    parser.add_argument("-ff", "--forgetting_factor", type=float, default=0.995,
+                        help="RLS forgetting factor (samples are forgotten with a time constant of 1/(1-ff) frames).")
     args = parser.parse_args()
 
     # get task
@@ -56,9 +63,23 @@ def main():
     decoder = None
     if args.decoder:
         decoder = load_decoder(args.decoder, num_dof, args.integration_beta)
+        if args.recalibrate:
+            decoder.enable_recalibration(forgetting_factor=args.forgetting_factor)
+
+    # optionally log the whole session to disk as it runs
+    session_log = None
+    if args.log_session:
+        num_chans = decoder.neuralsim.num_chans if decoder is not None else 0
+        session_log = SessionLog.create(num_dof, num_chans, decoder_name=args.decoder)
 
     # run the task
-    task(DataRecorder(), decoder, target_type=args.target_type, target_size = args.target_size, hold_time = args.target_hold_time, target_dof = args.target_dof)
+    try:
+        task(DataRecorder(), decoder, target_type=args.target_type, target_size = args.target_size, hold_time = args.target_hold_time, target_dof = args.target_dof, session_log = session_log)
+    finally:
+        if session_log is not None:
+            session_log.close()
+        if decoder is not None and decoder.recalibrating:
+            print(decoder.recalibration_report())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+import argparse
+import datetime
+import itertools
+import os
+import time
+from concurrent.futures import as_completed
+import pandas as pd
+
+import decoders.rnn
+import parallel
+import training
+
+
+SWEEP_DIR = os.path.join("data", "sweeps")
+
+# the hyperparameters each decoder type actually uses (the others are left out of its grid points)
+DECODER_PARAMS = {
+    "ridge": ("seq_len", "lmbda"),
+    "kalman": (),
+    "rnn": ("rnn_type", "hidden_size", "seq_len"),
+}
+
+_worker_data = {}   # per worker: fake brain name -> (shared array specs, neural_scaler, output_scaler)
+
+
+def build_grid(decoder_types, fake_brains, **param_values):
+    """All combinations of the given values, keeping only the parameters that matter for each decoder type"""
+    configs = []
+    for decoder_type in decoder_types:
+        names = DECODER_PARAMS[decoder_type]
+        for fake_brain in fake_brains:
+            for values in itertools.product(*(param_values[name] for name in names)):
+                configs.append({"decoder_type": decoder_type, "fake_brain": fake_brain, **dict(zip(names, values))})
+    return configs
+
+
+def _init_sweep_worker(shared_data):
+    _worker_data.update(shared_data)
+
+
+def run_config(config, train_kwargs):
+    """Train & evaluate one grid point in a worker process, on the shared preprocessed data"""
+    specs, neural_scaler, output_scaler = _worker_data[config["fake_brain"]]
+    data = training.TrainingData(**parallel.attach(specs), neural_scaler=neural_scaler, output_scaler=output_scaler)
+    params = {k: v for k, v in config.items() if k != "fake_brain"}
+
+    start = time.perf_counter()
+    model, results = training.train_decoder(data, **params, **train_kwargs, verbose=False)
+    row = {**config, "corr": results["corr"].mean(), "mse": results["mse"],
+           "epochs": len(results["loss_history"]) if results["loss_history"] is not None else None,
+           "train_time_s": time.perf_counter() - start}
+    for i, corr in enumerate(results["corr"]):
+        pvtype = "pos" if i < data.num_dof else "vel"
+        row[f"corr_{pvtype}{i % data.num_dof}"] = corr
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train decoders over a hyperparameter grid in parallel")
+    parser.add_argument("-d", "--dataset", default="dataset_20231012_250sec_random.pkl")
+    parser.add_argument("-fb", "--fake_brain", nargs='+', required=True, help="One or more fake brains.")
+    parser.add_argument("--decoder_type", nargs='+', default=["ridge"], choices=training.DECODER_TYPES)
+    parser.add_argument("--rnn_type", nargs='+', default=["gru"], choices=["rnn", "gru", "lstm"])
+    parser.add_argument("--hidden_size", nargs='+', type=int, default=[decoders.rnn.RNN_CONFIG["hidden_size"]])
+    parser.add_argument("--seq_len", nargs='+', type=int, default=[5])
+    parser.add_argument("--lmbda", nargs='+', type=float, default=[0.1])
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--tbptt", action="store_true", help="Train RNNs with truncated backprop (see main_train_decoder)")
+    parser.add_argument("--patience", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for simulating the neural data")
+    parser.add_argument("--train_data_frac", type=float, default=0.8)
+    parser.add_argument("-w", "--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("-t", "--threads_per_worker", type=int, default=1,
+                        help="torch/BLAS threads per worker (workers x threads should be at most the number of cores)")
+    parser.add_argument("-o", "--output", default=None, help="Results CSV (default data/sweeps/sweep_<date>.csv)")
+    args = parser.parse_args()
+
+    configs = build_grid(args.decoder_type, args.fake_brain, rnn_type=args.rnn_type, hidden_size=args.hidden_size,
+                         seq_len=args.seq_len, lmbda=args.lmbda)
+    train_kwargs = {"epochs": args.epochs, "batch_size": args.batch_size, "tbptt": args.tbptt,
+                    "patience": args.patience}
+    print(f"Sweeping {len(configs)} configurations with {args.workers} workers x {args.threads_per_worker} threads")
+
+    # simulate/normalize the data for each fake brain once (or load it from the cache), and share it with the workers
+    shared, shared_data = [], {}
+    try:
+        for name in args.fake_brain:
+            data = training.prepare_data(args.dataset, training.load_fakebrain(name), seed=args.seed,
+                                         train_data_frac=args.train_data_frac)
+            shared.append(parallel.SharedArrays(data.arrays()))
+            shared_data[name] = (shared[-1].specs, data.neural_scaler, data.output_scaler)
+
+        rows = []
+        with parallel.process_pool(args.workers, args.threads_per_worker, initializer=_init_sweep_worker,
+                                   initargs=(shared_data,)) as pool:
+            futures = {pool.submit(run_config, config, train_kwargs): config for config in configs}
+            for i, future in enumerate(as_completed(futures)):
+                row = future.result()
+                rows.append(row)
+                params = ", ".join(f"{k}={v}" for k, v in futures[future].items())
+                print(f"[{i + 1}/{len(configs)}] {params}: corr = {row['corr']:.4f}, mse = {row['mse']:.4f} "
+                      f"({row['train_time_s']:.1f} s)")
+    finally:
+        for s in shared:
+            s.close()
+
+    # one results table, best first
+    results = pd.DataFrame(rows).sort_values("corr", ascending=False)
+    output = args.output
+    if output is None:
+        os.makedirs(SWEEP_DIR, exist_ok=True)
+        output = os.path.join(SWEEP_DIR, f"sweep_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    results.to_csv(output, index=False)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(results.drop(columns=[c for c in results.columns if c.startswith("corr_")]).to_string(index=False))
+    print(f"Saved sweep results to {output}")
+
+
+if __name__ == "__main__":
+    main()
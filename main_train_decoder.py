@@ -1,17 +1,9 @@
-import torch.optim
 import os
-import pickle
-import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from torch.utils.data import DataLoader
 import argparse
 
-import neuralsim
 import decoders.rnn
-import decoders.ridge
-import data_loading as data_loading
+import training
 
 # parse training options
 parser = argparse.ArgumentParser()
@@ -20,12 +12,27 @@ parser.add_argument('-o', '--save_name', type=str, default=None)
 parser.add_argument('-fb', '--fake_brain', type=str, default=None)
 parser.add_argument('--decoder_type', type=str, default='rnn')
 parser.add_argument('--rnn_type', type=str, default='rnn')
+parser.add_argument('--hidden_size', type=int, default=decoders.rnn.RNN_CONFIG["hidden_size"])
 parser.add_argument('--epochs', type=int, default=50)
 parser.add_argument('--train_data_frac', type=float, default=0.8)
 parser.add_argument('--seq_len', type=int, default=20)
 parser.add_argument('--batch_size', type=int, default=256)
 parser.add_argument('--no_plot', action='store_false')
 parser.add_argument('--no_save', action='store_false')
+parser.add_argument('--seed', type=int, default=0, help="Random seed for simulating the neural data")
+parser.add_argument('--no_cache', action='store_true', help="Don't read/write the preprocessed data cache")
+parser.add_argument('--lmbda', type=float, default=0.1, help="Ridge regularization strength")
+parser.add_argument('--ridge_cv', action='store_true',
+                    help="Pick the ridge lambda by blocked k-fold cross-validation on the training data")
+parser.add_argument('--tbptt', action='store_true',
+                    help="Train the RNN statefully on contiguous chunks with truncated backprop (seq_len is unused)")
+parser.add_argument('--chunk_len', type=int, default=100, help="Truncated backprop length, in timesteps (with --tbptt)")
+parser.add_argument('--num_streams', type=int, default=16,
+                    help="Number of contiguous streams trained in parallel, i.e. the batch size (with --tbptt)")
+parser.add_argument('--patience', type=int, default=5,
+                    help="Stop RNN training after this many epochs without improvement in the held-out loss (0 = off)")
+parser.add_argument('--checkpoint_every', type=int, default=1, help="Save an RNN training checkpoint every N epochs")
+parser.add_argument('--resume', action='store_true', help="Resume RNN training from its last checkpoint")
 args = parser.parse_args()
 dataset_fname = args.dataset
 save_name = args.save_name
@@ -39,85 +46,27 @@ plot_training = args.no_plot
 save_decoder = args.no_save
 
 
-# load movement data
-if not dataset_fname.endswith(".pkl"):
-    dataset_fname += ".pkl"
-with open(os.path.join("data", "movedata", dataset_fname), 'rb') as f:
-    df = pickle.load(f)
-pos = np.stack(df.current_position.to_numpy())                                 # shape (num_timepts, num_dof)
-vel = np.vstack((np.zeros((1, pos.shape[1])), pos[1:, :] - pos[:-1, :]))       # vel is the derivative of pos
-posvel = np.hstack((pos, vel))
-num_trials = df.trial_number.iloc[-1] - df.trial_number.iloc[0]
-num_secs = (df.timestep.iloc[-1] - df.timestep.iloc[0]) / 1000
-num_dof = pos.shape[1]
-print(f"Loaded {num_trials} trials, with {num_secs:.1f} seconds of data")
-print(f"Number of samples: {posvel.shape[0]}")
-
-# load fake brain
+# load fake brain, then simulate & normalize the neural data (or load it from the cache)
 if args.fake_brain is None:
     raise ValueError("Must specify a fake brain")
-if not args.fake_brain.endswith(".pkl"):
-    args.fake_brain += ".pkl"
-with open(os.path.join("data", "fakebrains", args.fake_brain), 'rb') as f:
-    fake_brain, num_chans, brain_num_dof = pickle.load(f)
-assert brain_num_dof == num_dof
-print(f"Loaded fake brain: {args.fake_brain}")
-# neural_sim = neuralsim.LogLinUnitGenerator(num_chans, num_dof, pos_mult=0.5, vel_mult=2, noise_level=neural_noise_level)
-
-# generate fake neural data from the movements
-neural = fake_brain.generate(pos=pos, vel=vel)      # shape (num_timepts, num_chans)
-
-# split train/test
-x_train, x_test, y_train, y_test = train_test_split(neural, posvel, train_size=train_data_frac, shuffle=False)
-
-# normalize inputs & outputs
-neural_scaler = StandardScaler()
-neural_scaler.fit(x_train)
-x_train_norm = neural_scaler.transform(x_train)
-x_test_norm = neural_scaler.transform(x_test)
-
-output_scaler = StandardScaler()
-output_scaler.fit(y_train)
-y_train_norm = output_scaler.transform(y_train)
-y_test_norm = output_scaler.transform(y_test)
-
-# add time history (results in tensor of shape (num_samples, num_chans, seq_len))
-x_train_norm_hist = data_loading.add_time_history(x_train_norm, seq_len=seq_len)
-x_test_norm_hist = data_loading.add_time_history(x_test_norm, seq_len=seq_len)
-
-# setup dataloaders
-dataset_train = data_loading.SequenceDataset(x_train_norm_hist, torch.tensor(y_train_norm))
-dataset_test = data_loading.SequenceDataset(x_test_norm_hist, torch.tensor(y_test_norm))
-loader_train = DataLoader(dataset_train, batch_size=batch_size, shuffle=True, drop_last=True)
-loader_test = DataLoader(dataset_test, batch_size=len(dataset_test), shuffle=False, drop_last=False)
-
-# create and train decoder
-num_outputs = 2 * num_dof   # both pos & vel for each dof
-if decoder_type == 'ridge':
-    num_inputs_rr = x_train_norm_hist.shape[1] * x_train_norm_hist.shape[2]
-    model = decoders.ridge.RidgeRegression(num_inputs_rr, num_outputs, lmbda=0.1)
-    model.fit(x_train_norm_hist, y_train_norm)
-    y, yhat, _, _ = model.eval_perf(x_test_norm_hist, y_test_norm)
-    y = output_scaler.inverse_transform(y)
-    yhat = output_scaler.inverse_transform(yhat)
-    loss_history = None
-
-elif decoder_type == 'rnn':
-    # setup model and optimizer (we use the default hyperparams stored in the rnn.py module)
-    device = torch.device('cuda:0') if torch.cuda.is_available() else 'cpu'
-    model = decoders.rnn.RNN(num_chans, num_outputs, hidden_size=decoders.rnn.RNN_CONFIG["hidden_size"], rnn_type= rnn_type,device=device)
-    optimizer = torch.optim.Adam(model.parameters(),
-                                 lr=decoders.rnn.RNN_CONFIG["lr"],
-                                 weight_decay=decoders.rnn.RNN_CONFIG["weight_decay"])
-    loss_fn = torch.nn.MSELoss()
-
-    # train & evaluate accuracy
-    loss_history = model.fit(loader_train, optimizer, loss_fn, epochs, verbose=True)
-    y, yhat, _, _ = model.eval_perf(loader_test)
-    y = output_scaler.inverse_transform(y)
-    yhat = output_scaler.inverse_transform(yhat)
-else:
-    raise ValueError(f"Invalid decoder type: {decoder_type}")
+fake_brain = training.load_fakebrain(args.fake_brain)
+data = training.prepare_data(dataset_fname, fake_brain, seed=args.seed, train_data_frac=train_data_frac,
+                             use_cache=not args.no_cache)
+dataset_fname = data.dataset_fname
+num_dof = data.num_dof
+
+# checkpoints are kept in data/checkpoints under the decoder's save name, so an interrupted run can be resumed
+checkpoint_name = os.path.splitext(save_name or f"decoder_{decoder_type}_{rnn_type}_{dataset_fname}")[0]
+
+# create, train & evaluate decoder
+model, results = training.train_decoder(data, decoder_type=decoder_type, rnn_type=rnn_type,
+                                        hidden_size=args.hidden_size, seq_len=seq_len, lmbda=args.lmbda,
+                                        ridge_cv=args.ridge_cv, epochs=epochs, batch_size=batch_size,
+                                        tbptt=args.tbptt, chunk_len=args.chunk_len, num_streams=args.num_streams,
+                                        patience=args.patience,
+                                        checkpoint_path=os.path.join("data", "checkpoints", f"{checkpoint_name}.pt"),
+                                        checkpoint_every=args.checkpoint_every, resume=args.resume)
+y, yhat, loss_history = results["y"], results["yhat"], results["loss_history"]
 
 if True: #plot_training:
     if loss_history is not None:
@@ -142,12 +91,4 @@ if True: #plot_training:
 if save_decoder:
     if save_name is None:
         save_name = f"decoder_{decoder_type}_{dataset_fname}"
-    if not save_name.endswith(".pkl"):
-        save_name += ".pkl"
-
-    if decoder_type == 'rnn':
-        seq_len = 1     # for online RNNs we maintain a hidden state and only need one timestep
-
-    with open(os.path.join("data", "trained_decoders", save_name), 'wb') as f:
-        pickle.dump((model, fake_brain, neural_scaler, output_scaler, seq_len), f)
-    print(f"Saved decoder to {save_name}")
+    training.save_decoder(model, data, results["seq_len"], save_name)
@@ -1,13 +1,33 @@
 import numpy as np
+from scipy import sparse, signal
+
+
+# number of timesteps of noise pre-generated at once for the single-sample (online) path
+ONLINE_NOISE_BLOCK = 1000
+
+
+def _seeded_rng():
+    # a new Generator seeded from the global numpy RNG, so np.random.seed() makes its draws reproducible. Fake brains
+    # create one per call (or lazily for the online path) rather than keeping one, which would be pickled with the
+    # brain and ignore np.random.seed() after loading
+    return np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
 
 
 class LogLinUnitGenerator:
-    """Simulates neural data based on movements using a log-linear relationship, as in Trucollo et al. 2008"""
-    def __init__(self, num_chans, num_dof, pos_mult=1, vel_mult=1, noise_level=0.1):
+    """
+    Simulates neural data based on movements using a log-linear relationship, as in Trucollo et al. 2008
+
+    For high channel counts, `dtype=np.float32` halves memory and matmul/exp cost, and `tuned_frac` < 1 makes only the
+    first round(tuned_frac * num_chans) channels tuned to movement (the rest fire at their baseline rate), so the
+    tuning matmul only covers the tuned channels.
+    """
+    def __init__(self, num_chans, num_dof, pos_mult=1, vel_mult=1, noise_level=0.1, dtype=np.float64, tuned_frac=1.0):
         self.num_chans = num_chans
         self.num_dof = num_dof
         self.noise_level = noise_level  # std multiplier of the gaussian noise
         self.scaler = 1
+        self.dtype = np.dtype(dtype)
+        self.num_tuned = int(round(tuned_frac * num_chans))
 
         # create gaussian random relationships, using [P, V] as the latent state
         self.rand_mat = np.random.uniform(-1, 1, size=(2 * num_dof + 1, num_chans))
@@ -17,6 +37,28 @@ class LogLinUnitGenerator:
         mult = np.tile(mult.reshape(-1, 1), (1, num_chans))
         self.rand_mat *= mult
 
+        # untuned channels only keep their baseline (bias) weight
+        self.rand_mat[:-1, self.num_tuned:] = 0
+        self.rand_mat = self.rand_mat.astype(self.dtype)
+
+        # preallocated buffers for generate_one (created lazily on first use)
+        self._state_buf = None
+
+    def __getstate__(self):
+        # don't save the online buffers/noise block with the fake brain
+        state = self.__dict__.copy()
+        state['_state_buf'] = None
+        for key in ('_rate_buf', '_out_buf', '_noise_block', '_noise_rng', '_noise_block_level', '_noise_idx'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        # fake brains pickled before the dtype/sparse tuning options existed are dense float64
+        self.__dict__.update(state)
+        self.__dict__.setdefault('dtype', np.dtype(np.float64))
+        self.__dict__.setdefault('num_tuned', self.num_chans)
+        self.__dict__.setdefault('_state_buf', None)
+
     def generate(self, pos, vel):
         """
         Generate neural data for each timestep given matrices of position and velocity.
@@ -28,6 +70,30 @@ class LogLinUnitGenerator:
         Returns:
         - np.array of shape (time_steps, num_chans) representing neural activity at each timestep.
         """
+        return self._generate(pos, vel, self._new_rng())
+
+    def _new_rng(self):
+        # the legacy global RNG only draws float64, so low-precision brains use a Generator seeded from it for each
+        # call (or stream). float64 brains keep drawing from the global RNG, so existing seeds give the same data
+        return None if self.dtype == np.float64 else _seeded_rng()
+
+    def _generate(self, pos, vel, rng):
+        # Compute average firing rate
+        avgfr = self.firing_rate(pos, vel)
+
+        # Generate neural activity with Gaussian noise
+        if self.dtype == np.float64:
+            neural_activity = np.random.normal(loc=avgfr, scale=np.abs(avgfr * self.noise_level))
+        else:
+            neural_activity = rng.standard_normal(avgfr.shape, dtype=self.dtype)
+            neural_activity *= abs(self.noise_level)
+            neural_activity += 1
+            neural_activity *= avgfr
+
+        return neural_activity
+
+    def firing_rate(self, pos, vel):
+        """Average (noise-free) firing rate, shape (time_steps, num_chans), for pos/vel of shape (time_steps, num_dof)"""
         if pos.ndim == 1:
             pos = pos.reshape((1, -1))
         if vel.ndim == 1:
@@ -35,12 +101,463 @@ class LogLinUnitGenerator:
 
         # Concatenate pos, vel, and a column of ones
         time_steps = pos.shape[0]
-        state = np.hstack([pos - 0.5, vel, np.ones((time_steps, 1))])
+        state = np.hstack([pos - 0.5, vel, np.ones((time_steps, 1))]).astype(self.dtype, copy=False)
 
-        # Compute average firing rate
-        avgfr = np.exp(self.scaler * state @ self.rand_mat)
+        if self.num_tuned == self.num_chans:
+            return np.exp(self.scaler * state @ self.rand_mat)
 
-        # Generate neural activity with Gaussian noise
-        neural_activity = np.random.normal(loc=avgfr, scale=np.abs(avgfr * self.noise_level))
+        # sparse tuning: baseline for every channel, plus [P, V] tuning for the tuned channels only
+        rate = np.empty((time_steps, self.num_chans), dtype=self.dtype)
+        rate[:] = self.rand_mat[-1]
+        rate[:, :self.num_tuned] += state[:, :-1] @ self.rand_mat[:-1, :self.num_tuned]
+        if self.scaler != 1:
+            rate *= self.scaler
+        return np.exp(rate, out=rate)
 
-        return neural_activity
+    def generate_one(self, pos, vel, out=None):
+        """
+        Allocation-free version of `generate` for a single timestep, used for closed-loop (online) control.
+        Uses preallocated state/firing-rate buffers and draws noise from a pre-generated block that is refilled in
+        bulk every ONLINE_NOISE_BLOCK calls (or when noise_level changes).
+
+        Parameters:
+        - pos: np.array of shape (num_dof,) representing the current position.
+        - vel: np.array of shape (num_dof,) representing the current velocity.
+        - out: optional np.array of shape (num_chans,) to write into. If None, an internal buffer is reused, so copy
+          the result if you need to keep it past the next call.
+
+        Returns:
+        - np.array of shape (num_chans,) representing neural activity.
+        """
+        rate = self._firing_rate_one(pos, vel)
+        if out is None:
+            out = self._out_buf
+
+        # gaussian noise with std proportional to the firing rate: rate + |rate * noise_level| * z, where the block
+        # holds the pre-scaled (1 + |noise_level| * z) terms
+        if self._noise_idx >= ONLINE_NOISE_BLOCK or self._noise_block_level != self.noise_level:
+            self._refill_noise()
+        np.multiply(rate, self._noise_block[self._noise_idx], out=out)
+        self._noise_idx += 1
+
+        return out
+
+    def _firing_rate_one(self, pos, vel):
+        # average firing rate for a single timestep, written into the preallocated rate buffer
+        if self._state_buf is None:
+            self._init_online_buffers()
+
+        # fill in the [P - 0.5, V, 1] latent state in place
+        state, rate, d, n = self._state_buf, self._rate_buf, self.num_dof, self.num_tuned
+        np.subtract(pos, 0.5, out=state[:d])
+        state[d:2 * d] = vel
+
+        if n == self.num_chans:
+            np.dot(state, self.rand_mat, out=rate)
+        else:
+            rate[n:] = self.rand_mat[-1, n:]
+            np.dot(state, self.rand_mat[:, :n], out=rate[:n])
+        if self.scaler != 1:
+            rate *= self.scaler
+        np.exp(rate, out=rate)
+        return rate
+
+    def _init_online_buffers(self):
+        self._state_buf = np.ones(2 * self.num_dof + 1, dtype=self.dtype)
+        self._rate_buf = np.empty(self.num_chans, dtype=self.dtype)
+        self._out_buf = np.empty(self.num_chans, dtype=self.dtype)
+        self._noise_block = np.empty((ONLINE_NOISE_BLOCK, self.num_chans), dtype=self.dtype)
+        # seed from the global numpy RNG so np.random.seed() still makes online runs reproducible
+        self._noise_rng = np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+        self._refill_noise()
+
+    def _refill_noise(self):
+        self._noise_rng.standard_normal(out=self._noise_block, dtype=self._noise_block.dtype)
+        self._noise_block *= abs(self.noise_level)
+        self._noise_block += 1
+        self._noise_block_level = self.noise_level
+        self._noise_idx = 0
+
+    def generate_stream(self, chunks):
+        """
+        Generate neural data block-by-block from an iterator of (pos, vel) blocks, e.g. from `iter_chunks`.
+        Peak memory is set by the block size rather than the recording length, so long datasets can be written
+        straight to disk. Since noise is drawn in the same order (from one Generator for the whole stream for
+        low-precision brains), with the same seed the concatenated output matches `generate` on the full pos/vel
+        matrices.
+
+        Parameters:
+        - chunks: iterable of (pos, vel) tuples, each np.array of shape (chunk_steps, num_dof).
+
+        Yields:
+        - np.array of shape (chunk_steps, num_chans) for each input block.
+        """
+        rng = self._new_rng()
+        for pos, vel in chunks:
+            yield self._generate(pos, vel, rng)
+
+
+class PoissonSpikeGenerator(LogLinUnitGenerator):
+    """
+    Spike-level version of LogLinUnitGenerator. Uses the same log-linear tuning, but treats the firing rate as the
+    expected number of spikes per bin and draws Poisson spike counts. Spikes can also be simulated at sub-bin
+    resolution, returned as a sparse (CSR) matrix of counts or as a list of spike times.
+
+    `generate` and `generate_one` return binned counts, so this can be used anywhere a LogLinUnitGenerator is used
+    (e.g. main_create_fakebrain.py and RealTimeDecoder).
+    """
+    def __init__(self, num_chans, num_dof, pos_mult=1, vel_mult=1, noise_level=0.0, bin_ms=20, resolution_ms=1,
+                 dtype=np.float64, tuned_frac=1.0):
+        super().__init__(num_chans, num_dof, pos_mult=pos_mult, vel_mult=vel_mult, noise_level=noise_level,
+                         dtype=dtype, tuned_frac=tuned_frac)
+        if bin_ms % resolution_ms != 0:
+            raise ValueError(f"bin_ms ({bin_ms}) must be a multiple of resolution_ms ({resolution_ms})")
+        self.bin_ms = bin_ms
+        self.resolution_ms = resolution_ms
+        self.num_subbins = int(bin_ms // resolution_ms)
+
+    def __setstate__(self, state):
+        # older spike-level brains were pickled with their own Generator, which ignored np.random.seed()
+        state.pop('rng', None)
+        super().__setstate__(state)
+
+    def spike_rate(self, pos, vel, rng=None):
+        """Expected spikes per bin, shape (time_steps, num_chans). noise_level adds gaussian jitter to the rate."""
+        rate = self.firing_rate(pos, vel)
+        if self.noise_level:
+            rng = rng if rng is not None else _seeded_rng()
+            rate *= np.maximum(1 + self.noise_level * rng.standard_normal(rate.shape, dtype=self.dtype), 0)
+        return rate
+
+    def generate(self, pos, vel):
+        """
+        Generate binned spike counts for each timestep given matrices of position and velocity.
+
+        Parameters:
+        - pos: np.array of shape (time_steps, num_dof) representing position at each timestep.
+        - vel: np.array of shape (time_steps, num_dof) representing velocity at each timestep.
+
+        Returns:
+        - np.array of shape (time_steps, num_chans) with the number of spikes in each bin.
+        """
+        return self._generate(pos, vel, self._new_rng())
+
+    def _new_rng(self):
+        return _seeded_rng()
+
+    def _generate(self, pos, vel, rng):
+        return rng.poisson(self.spike_rate(pos, vel, rng)).astype(self.dtype)
+
+    def generate_one(self, pos, vel, out=None):
+        """Binned spike counts for a single timestep, shape (num_chans,). See LogLinUnitGenerator.generate_one"""
+        rate = self._firing_rate_one(pos, vel)
+        if out is None:
+            out = self._out_buf
+        if self.noise_level:
+            rate *= np.maximum(1 + self.noise_level * self._noise_rng.standard_normal(self.num_chans, dtype=self.dtype),
+                               0)
+        out[:] = self._noise_rng.poisson(rate)
+        return out
+
+    def generate_spikes(self, pos, vel):
+        """
+        Generate spike counts at sub-bin resolution (resolution_ms). Within a bin the rate is constant, so each spike
+        is placed uniformly in one of the bin's sub-bins.
+
+        Returns:
+        - scipy.sparse.csr_matrix of shape (time_steps * num_subbins, num_chans) with spike counts per sub-bin.
+        """
+        rng = _seeded_rng()
+        bins, chans = self._draw_spikes(pos, vel, rng)
+        subbin = rng.integers(0, self.num_subbins, size=len(bins))
+        num_rows = len(pos) * self.num_subbins if np.ndim(pos) > 1 else self.num_subbins
+        # duplicate (row, chan) entries are summed when converting to CSR
+        return sparse.csr_matrix((np.ones(len(bins), dtype=np.int32), (bins * self.num_subbins + subbin, chans)),
+                                 shape=(num_rows, self.num_chans))
+
+    def generate_spike_times(self, pos, vel):
+        """
+        Generate individual spike times (in ms, relative to the start of the first bin).
+
+        Returns:
+        - tuple (spike_times, spike_chans) of np.arrays, sorted by time.
+        """
+        rng = _seeded_rng()
+        bins, chans = self._draw_spikes(pos, vel, rng)
+        times = (bins + rng.random(len(bins))) * self.bin_ms
+        order = np.argsort(times, kind='stable')
+        return times[order], chans[order]
+
+    def _draw_spikes(self, pos, vel, rng):
+        # draw the spike count for every bin & channel at once, then expand to one (bin, chan) entry per spike
+        counts = rng.poisson(self.spike_rate(pos, vel, rng))
+        bin_idx, chan_idx = np.nonzero(counts)
+        num_spikes = counts[bin_idx, chan_idx]
+        return np.repeat(bin_idx, num_spikes), np.repeat(chan_idx, num_spikes)
+
+    def _init_online_buffers(self):
+        # spike counts depend on the rate, so there's no pre-generated noise block
+        self._state_buf = np.ones(2 * self.num_dof + 1, dtype=self.dtype)
+        self._rate_buf = np.empty(self.num_chans, dtype=self.dtype)
+        self._out_buf = np.empty(self.num_chans, dtype=self.dtype)
+        self._noise_rng = _seeded_rng()
+
+
+class BroadbandSimulator:
+    """
+    Simulates raw broadband voltage (e.g. 30 kHz) from a tuned rate model, then band-pass filters and threshold-crosses
+    it into the binned counts the decoders consume, like a real spike-detection pipeline.
+
+    Each bin, Poisson spikes are drawn from `rate_model.firing_rate` (spikes per bin) and placed as biphasic waveforms
+    (with a random amplitude per channel) on top of gaussian noise. Processing is streaming: the IIR filter state,
+    the tail of waveforms that run past the end of a chunk, and the last filtered sample (for crossing detection) are
+    carried across the chunks of a `generate` call, the blocks of `generate_stream` and successive `generate_one`
+    calls, and every step is vectorized across channels. `generate`, `generate_stream` and `generate_broadband` start
+    from a reset state, drawing their noise from the global numpy RNG (so np.random.seed() makes them reproducible).
+
+    `generate` and `generate_one` return threshold crossings per bin, so this can be used anywhere a
+    LogLinUnitGenerator is used (e.g. main_create_fakebrain.py and RealTimeDecoder).
+    """
+    def __init__(self, rate_model, fs=30000, bin_ms=20, noise_uv=10.0, spike_amp_uv=(40.0, 120.0),
+                 band_hz=(250, 5000), filter_order=2, threshold_rms=-4.5, chunk_bins=25):
+        if (fs * bin_ms) % 1000 != 0:
+            raise ValueError(f"bin_ms ({bin_ms}) must be a whole number of samples at fs={fs}")
+        self.rate_model = rate_model
+        self.num_chans = rate_model.num_chans
+        self.num_dof = rate_model.num_dof
+        self.noise_level = rate_model.noise_level
+        self.fs = fs
+        self.bin_ms = bin_ms
+        self.samples_per_bin = fs * bin_ms // 1000
+        self.noise_uv = noise_uv
+        self.chunk_bins = chunk_bins    # max bins processed at once by `generate`, bounds memory for long datasets
+
+        rng = _seeded_rng()
+        self.spike_amp = rng.uniform(*spike_amp_uv, size=(self.num_chans, 1)).astype(np.float32)
+
+        # biphasic spike waveform (~1.6 ms), normalized to a trough of -1
+        t_ms = np.arange(int(1.6e-3 * fs)) * 1000 / fs
+        waveform = -np.exp(-((t_ms - 0.4) / 0.15) ** 2) + 0.35 * np.exp(-((t_ms - 0.8) / 0.3) ** 2)
+        self.waveform = (waveform / -waveform.min()).astype(np.float32)
+
+        # band-pass filter, applied along time with data laid out as (num_chans, num_samples)
+        self.sos = signal.butter(filter_order, band_hz, btype='band', fs=fs, output='sos').astype(np.float32)
+
+        # threshold at a multiple of the filtered noise RMS (the same for every channel, since noise is white)
+        calib = signal.sosfilt(self.sos, rng.standard_normal(fs, dtype=np.float32) * np.float32(noise_uv))
+        self.threshold = np.float32(threshold_rms * np.sqrt(np.mean(calib[fs // 10:] ** 2)))
+
+        self.reset()
+
+    def __getstate__(self):
+        # the streaming state and the online Generator are rebuilt on load, so loaded simulators follow np.random.seed()
+        state = self.__dict__.copy()
+        for key in ('_zi', '_tail', '_last_below', '_rng'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        state.pop('rng', None)      # older simulators were pickled with their own Generator
+        self.__dict__.update(state)
+        self.reset()
+
+    def reset(self):
+        """Clear the streaming state (filter memory, waveform tails, last filtered sample) and the online RNG"""
+        self._zi = np.zeros((self.sos.shape[0], self.num_chans, 2), dtype=np.float32)
+        self._tail = np.zeros((self.num_chans, len(self.waveform) - 1), dtype=np.float32)
+        self._last_below = np.zeros((self.num_chans, 1), dtype=bool)
+        self._rng = None    # seeded from the global RNG on the next generate_one
+
+    def generate(self, pos, vel):
+        """
+        Generate threshold-crossing counts for each timestep given matrices of position and velocity.
+
+        Parameters:
+        - pos: np.array of shape (time_steps, num_dof) representing position at each timestep.
+        - vel: np.array of shape (time_steps, num_dof) representing velocity at each timestep.
+
+        Returns:
+        - np.array of shape (time_steps, num_chans) with the number of threshold crossings in each bin.
+        """
+        self.reset()
+        return self._generate(pos, vel, _seeded_rng())
+
+    def generate_one(self, pos, vel, out=None):
+        """Threshold crossings for a single timestep, shape (num_chans,). See LogLinUnitGenerator.generate_one"""
+        if self._rng is None:
+            self._rng = _seeded_rng()
+        counts = self._process(self.rate_model.firing_rate(pos, vel), self._rng)[0][0]
+        if out is None:
+            return counts
+        out[:] = counts
+        return out
+
+    def generate_stream(self, chunks):
+        """
+        Threshold crossings block-by-block from an iterator of (pos, vel) blocks. See LogLinUnitGenerator. The
+        streaming state and a single Generator carry across blocks, so the result matches `generate` on the whole
+        recording.
+        """
+        self.reset()
+        rng = _seeded_rng()
+        for pos, vel in chunks:
+            yield self._generate(pos, vel, rng)
+
+    def generate_broadband(self, pos, vel):
+        """
+        Like `generate`, but also returns the voltage traces (in uV) for inspection.
+
+        Returns:
+        - counts: np.array of shape (time_steps, num_chans)
+        - raw: np.array of shape (num_chans, time_steps * samples_per_bin), broadband voltage
+        - filtered: np.array of shape (num_chans, time_steps * samples_per_bin), band-pass filtered voltage
+        """
+        self.reset()
+        return self._process(self.rate_model.firing_rate(pos, vel), _seeded_rng(), keep_voltage=True)
+
+    def _generate(self, pos, vel, rng):
+        if pos.ndim == 1:
+            pos = pos.reshape((1, -1))
+            vel = vel.reshape((1, -1))
+        counts = np.empty((len(pos), self.num_chans), dtype=getattr(self.rate_model, 'dtype', np.float64))
+        for start in range(0, len(pos), self.chunk_bins):
+            stop = start + self.chunk_bins
+            rate = self.rate_model.firing_rate(pos[start:stop], vel[start:stop])
+            counts[start:stop] = self._process(rate, rng)[0]
+        return counts
+
+    def _process(self, rate, rng, keep_voltage=False):
+        # rate has shape (num_bins, num_chans), in expected spikes per bin
+        num_bins = rate.shape[0]
+        num_samples = num_bins * self.samples_per_bin
+        wave_len = len(self.waveform)
+
+        # draw spikes and place them uniformly within their bin
+        spike_counts = rng.poisson(rate)
+        bin_idx, chan_idx = np.nonzero(spike_counts)
+        num_spikes = spike_counts[bin_idx, chan_idx]
+        bin_idx, chan_idx = np.repeat(bin_idx, num_spikes), np.repeat(chan_idx, num_spikes)
+        onsets = bin_idx * self.samples_per_bin + rng.integers(0, self.samples_per_bin, size=len(bin_idx))
+
+        # add all waveforms at once: each spike contributes wave_len samples at (chan, onset + k)
+        row_len = num_samples + wave_len - 1
+        lin_idx = (chan_idx * row_len + onsets)[:, None] + np.arange(wave_len)
+        weights = self.spike_amp[chan_idx] * self.waveform
+        spikes = np.bincount(lin_idx.ravel(), weights=weights.ravel(), minlength=self.num_chans * row_len)
+        spikes = spikes.reshape(self.num_chans, row_len).astype(np.float32)
+
+        # carry in the waveform tails from the previous chunk, and save this chunk's tails for the next one
+        overlap = min(wave_len - 1, num_samples)
+        spikes[:, :overlap] += self._tail[:, :overlap]
+        self._tail = np.concatenate([self._tail[:, overlap:], np.zeros((self.num_chans, overlap), np.float32)], axis=1)
+        self._tail += spikes[:, num_samples:]
+
+        # broadband = spikes + gaussian noise
+        raw = rng.standard_normal((self.num_chans, num_samples), dtype=np.float32)
+        raw *= np.float32(self.noise_uv)
+        raw += spikes[:, :num_samples]
+
+        # stateful band-pass filter & negative-going threshold crossings
+        filtered, self._zi = signal.sosfilt(self.sos, raw, axis=-1, zi=self._zi)
+        below = filtered < self.threshold
+        crossings = below & ~np.concatenate([self._last_below, below[:, :-1]], axis=1)
+        self._last_below = below[:, -1:]
+        counts = crossings.reshape(self.num_chans, num_bins, self.samples_per_bin).sum(axis=2).T
+
+        if keep_voltage:
+            return counts, raw, filtered
+        return counts, None, None
+
+
+class BrainBank:
+    """
+    A stack of K LogLinUnitGenerator fake brains (e.g. with different noise levels and channel counts) that generates
+    neural data for all of them in one vectorized pass: a single batched einsum for the firing rates and one bulk
+    noise draw. Brains with fewer channels are zero-padded up to the largest channel count. The bank computes in the
+    common dtype of the brains (np.result_type), and each brain's data is returned in its own dtype.
+
+    The bank is a library API (e.g. for scripted multi-brain experiments). The training data cache and sweeps still
+    simulate each brain on its own, since the bulk noise draw depends on which brains are in the bank, while cached
+    data must only depend on the brain and seed.
+    """
+    def __init__(self, brains):
+        if any(type(b) is not LogLinUnitGenerator for b in brains):
+            raise ValueError("BrainBank only supports LogLinUnitGenerator fake brains")
+        if len({b.num_dof for b in brains}) != 1:
+            raise ValueError("All fake brains in a BrainBank must have the same number of DoF")
+        self.num_brains = len(brains)
+        self.num_dof = brains[0].num_dof
+        self.num_chans = np.array([b.num_chans for b in brains])
+        self.noise_levels = np.array([b.noise_level for b in brains], dtype=float)
+        self.scalers = np.array([b.scaler for b in brains], dtype=float)
+        self.num_tuned = np.array([b.num_tuned for b in brains])
+        self.dtypes = [b.dtype for b in brains]
+
+        # tuning matrices stacked into shape (num_brains, 2 * num_dof + 1, max_chans)
+        self.rand_mats = np.zeros((self.num_brains, 2 * self.num_dof + 1, self.num_chans.max()),
+                                  dtype=np.result_type(*(b.rand_mat for b in brains)))
+        for k, b in enumerate(brains):
+            self.rand_mats[k, :, :b.num_chans] = b.rand_mat
+
+    @classmethod
+    def create(cls, num_brains, num_chans, num_dof, noise_levels, pos_mult=1, vel_mult=1, dtype=np.float64,
+               tuned_frac=1.0):
+        """Create num_brains new fake brains. num_chans and noise_levels can be a single value or one per brain"""
+        num_chans = np.broadcast_to(num_chans, (num_brains,))
+        noise_levels = np.broadcast_to(noise_levels, (num_brains,))
+        return cls([LogLinUnitGenerator(int(c), num_dof, pos_mult=pos_mult, vel_mult=vel_mult, noise_level=float(n),
+                                        dtype=dtype, tuned_frac=tuned_frac)
+                    for c, n in zip(num_chans, noise_levels)])
+
+    def brains(self):
+        """Unstack into a list of LogLinUnitGenerators (e.g. for saving each one as a fake brain file)"""
+        brains = []
+        for k in range(self.num_brains):
+            b = LogLinUnitGenerator.__new__(LogLinUnitGenerator)
+            b.num_chans, b.num_dof = int(self.num_chans[k]), self.num_dof
+            b.noise_level, b.scaler = float(self.noise_levels[k]), float(self.scalers[k])
+            b.dtype, b.num_tuned = self.dtypes[k], int(self.num_tuned[k])
+            b.rand_mat = self.rand_mats[k, :, :b.num_chans].astype(b.dtype)
+            b._state_buf = None
+            brains.append(b)
+        return brains
+
+    def generate(self, pos, vel):
+        """
+        Generate neural data for every brain given matrices of position and velocity.
+
+        Parameters:
+        - pos: np.array of shape (time_steps, num_dof) representing position at each timestep.
+        - vel: np.array of shape (time_steps, num_dof) representing velocity at each timestep.
+
+        Returns:
+        - list of num_brains np.arrays, each of shape (time_steps, num_chans[k]) and in brain k's dtype. Where that
+          is the bank's dtype, these are views into one padded array of shape (num_brains, time_steps, max_chans).
+        """
+        if pos.ndim == 1:
+            pos = pos.reshape((1, -1))
+        if vel.ndim == 1:
+            vel = vel.reshape((1, -1))
+        dtype = self.rand_mats.dtype
+        state = np.hstack([pos - 0.5, vel, np.ones((pos.shape[0], 1))]).astype(dtype, copy=False)
+
+        # average firing rate for all brains at once, shape (num_brains, time_steps, max_chans)
+        avgfr = np.einsum('tf,kfc->ktc', state, self.rand_mats, optimize=True)
+        avgfr *= self.scalers.astype(dtype)[:, None, None]
+        np.exp(avgfr, out=avgfr)
+
+        # gaussian noise with std proportional to the firing rate: avgfr * (1 + |noise_level| * z). The bulk draw uses
+        # a Generator (faster than the legacy global RNG), seeded from the global RNG so np.random.seed() still applies
+        rng = np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+        neural = rng.standard_normal(avgfr.shape, dtype=dtype)
+        neural *= np.abs(self.noise_levels).astype(dtype)[:, None, None]
+        neural += 1
+        neural *= avgfr
+
+        return [neural[k, :, :c].astype(self.dtypes[k], copy=False) for k, c in enumerate(self.num_chans)]
+
+
+def iter_chunks(pos, vel, chunk_size=10000):
+    """Split pos/vel arrays (which can be memory-mapped) into blocks of at most chunk_size timesteps"""
+    for start in range(0, len(pos), chunk_size):
+        yield pos[start:start + chunk_size], vel[start:start + chunk_size]
@@ -0,0 +1,74 @@
+"""
+Helpers for running training/evaluation jobs in parallel worker processes (see main_sweep.py):
+- SharedArrays puts numpy arrays in shared memory once, and workers `attach` to them by name, so the preprocessed
+  data isn't pickled and copied for every task.
+- process_pool starts workers with a fixed number of torch/BLAS threads each, so num_workers x threads doesn't
+  oversubscribe the CPU.
+"""
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import torch
+from threadpoolctl import threadpool_limits
+
+
+_attached = {}      # shared memory blocks this process has attached to, by name
+
+
+class SharedArrays:
+    """
+    Copies a dict of numpy arrays into shared memory blocks. `specs` is a small picklable description (block names,
+    shapes & dtypes) to send to workers instead of the data. Call close() (or use as a context manager) when done,
+    which frees the memory.
+    """
+    def __init__(self, arrays):
+        self.blocks = []
+        self.specs = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            self.blocks.append(shm)
+            self.specs[name] = (shm.name, arr.shape, arr.dtype.str)
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(specs):
+    """Read-only numpy views of arrays shared by SharedArrays (each block is only attached once per process)"""
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        if shm_name not in _attached:
+            _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+        arr = np.ndarray(shape, dtype=dtype, buffer=_attached[shm_name].buf)
+        arr.flags.writeable = False
+        arrays[name] = arr
+    return arrays
+
+
+def _init_worker(num_threads, initializer, initargs):
+    torch.set_num_threads(num_threads)
+    threadpool_limits(limits=num_threads)      # numpy/scipy BLAS (e.g. the ridge Gram matrix)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def process_pool(num_workers, threads_per_worker=1, initializer=None, initargs=()):
+    """
+    ProcessPoolExecutor whose workers use threads_per_worker torch & BLAS threads. Workers are spawned rather than
+    forked (forking a process that has already started torch/OpenMP threads can deadlock), so the functions submitted
+    must be importable, and scripts using this need an `if __name__ == "__main__":` guard.
+    """
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context("spawn"),
+                               initializer=_init_worker, initargs=(threads_per_worker, initializer, initargs))
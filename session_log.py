@@ -0,0 +1,103 @@
+import datetime
+import json
+import os
+import time
+import numpy as np
+
+
+SESSION_DIR = os.path.join("data", "sessions")
+MAGIC = b"BCISLOG\x01"
+HEADER_ALIGN = 64           # records start on a 64-byte boundary
+
+
+def session_dtype(num_dof, num_chans):
+    """Fixed-size record written once per frame"""
+    return np.dtype([
+        ("timestamp", np.int64),                        # task clock, in ms
+        ("wall_time", np.float64),                      # time.time(), for aligning with other recordings
+        ("online", np.bool_),
+        ("desired_pos", np.float64, (num_dof,)),        # user's intended position (mouse / hand tracker)
+        ("decoded_pos", np.float64, (num_dof,)),        # position after velocity integration (NaN when offline)
+        ("decoded_posvel", np.float64, (2 * num_dof,)), # raw decoder output, unnormalized (NaN when offline)
+        ("neural", np.float32, (num_chans,)),           # simulated neural bin, before normalization (NaN when offline)
+    ])
+
+
+class SessionLog:
+    """
+    Crash-safe, append-only log of a whole task session, including the neural data and decoder outputs.
+
+    File layout: an 8-byte magic, a uint32 header length, a JSON header (num_dof, num_chans, record dtype, ...) padded
+    to HEADER_ALIGN bytes, then fixed-size records. Each frame's record is written straight to the OS with one
+    unbuffered write, so if the process is killed the log is intact up to the last frame. Since records are fixed
+    size, record i is at byte header_size + i * record_size and the log can be memory-mapped (see `read_session_log`).
+    """
+    def __init__(self, path, num_dof, num_chans, decoder_name=None):
+        self.path = path
+        self.dtype = session_dtype(num_dof, num_chans)
+        self._rec = np.zeros(1, dtype=self.dtype)
+        self.num_records = 0
+
+        header = json.dumps({
+            "version": 1,
+            "num_dof": num_dof,
+            "num_chans": num_chans,
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "record_size": self.dtype.itemsize,
+            "created": datetime.datetime.now().isoformat(),
+            "decoder": decoder_name,
+        }).encode()
+        header_len = -(-(len(MAGIC) + 4 + len(header)) // HEADER_ALIGN) * HEADER_ALIGN - len(MAGIC) - 4
+        header = header.ljust(header_len)
+
+        self._file = open(path, "xb", buffering=0)
+        self._file.write(MAGIC + np.uint32(header_len).tobytes() + header)
+
+    @classmethod
+    def create(cls, num_dof, num_chans, decoder_name=None, session_dir=SESSION_DIR):
+        os.makedirs(session_dir, exist_ok=True)
+        datestr = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(session_dir, f"session_{datestr}.bcilog")
+        print(f"Logging session to {path}")
+        return cls(path, num_dof, num_chans, decoder_name)
+
+    def log(self, timestamp, desired_pos, online, decoder=None):
+        """Append one frame. When online, the decoder's latest neural bin and outputs are included"""
+        rec = self._rec
+        rec["timestamp"] = timestamp
+        rec["wall_time"] = time.time()
+        rec["online"] = online
+        rec["desired_pos"] = desired_pos
+        if online and decoder is not None:
+            rec["decoded_pos"] = decoder.prev_actual_pos
+            rec["decoded_posvel"] = decoder.last_decoded_posvel
+            rec["neural"] = decoder.last_neural
+        else:
+            rec["decoded_pos"] = np.nan
+            rec["decoded_posvel"] = np.nan
+            rec["neural"] = np.nan
+        self._file.write(rec.data)
+        self.num_records += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            print(f"Saved session log ({self.num_records} frames) to {self.path}")
+
+
+def read_session_log(path, mmap_mode='r'):
+    """
+    Read a session log. Returns (header dict, records), where records is a memory-mapped structured array.
+    A partially written final record (e.g. if the task was killed mid-write) is ignored.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a session log: {path}")
+        header_len = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+        header = json.loads(f.read(header_len))
+    offset = len(MAGIC) + 4 + header_len
+    dtype = np.lib.format.descr_to_dtype(header["descr"])
+    num_records = (os.path.getsize(path) - offset) // dtype.itemsize
+    if num_records == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode=mmap_mode, offset=offset, shape=(num_records,))
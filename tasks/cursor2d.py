@@ -62,7 +62,7 @@ def unnormalize_pos(pos):
     return pos[0] * SCREEN_WIDTH, pos[1] * SCREEN_HEIGHT
 
 
-def cursor_task(recorder, decoder=None, target_type="random"):
+def cursor_task(recorder, decoder=None, target_type="random", session_log=None):
     pygame.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Cursor Task")
@@ -153,7 +153,11 @@ def cursor_task(recorder, decoder=None, target_type="random"):
             cursor_pos_in = np.array(normalize_pos(cursor_position))
             cursor_position = decoder.decode(cursor_pos_in)
             cursor_position = unnormalize_pos(cursor_position)
-            neural_history.append(decoder.get_recent_neural())
+            neural_history.append(decoder.normalize_neural(decoder.get_recent_neural()))
+
+        # log every frame (intended position, and neural data/decoder outputs when online)
+        if session_log is not None:
+            session_log.log(pygame.time.get_ticks(), normalize_pos(pygame.mouse.get_pos()), online, decoder)
 
         # if space bar is pressed, reset the position to the cursor (useful if the decoded position gets biased)
         keys = pygame.key.get_pressed()
@@ -27,7 +27,7 @@ NUM_NEURAL_HISTORY_PLOT = 100   # number of timepoints
 CV2_CAMERA_ID = 0               # default camera id for cv2 (usually the webcam)
 
 
-def hand_task(recorder, decoder, target_type="random", target_size = 0.15, hold_time = 500, target_dof = 1, is_demo = False, decoder_name = "GT"):
+def hand_task(recorder, decoder, target_type="random", target_size = 0.15, hold_time = 500, target_dof = 1, is_demo = False, decoder_name = "GT", session_log = None):
     print("\n\t✋  🤙 ✊️  Starting hand task, use ctrl-c to exit  ✌️ 👌 🖐  \n")
     
     # Target generation
@@ -153,11 +153,15 @@ def hand_task(recorder, decoder, target_type="random", target_size = 0.15, hold_
             # run the decoder to get cursor position
             hand_pos_in = np.array(hand_pos_true)
             hand_pos = decoder.decode(hand_pos_in)
-            neural_history.append(decoder.get_recent_neural())
+            neural_history.append(decoder.normalize_neural(decoder.get_recent_neural()))
 
         else:
             # offline - just use the true hand position
             hand_pos = hand_pos_true  
+
+        # log every frame (intended position, and neural data/decoder outputs when online)
+        if session_log is not None:
+            session_log.log(clock.get_time_ms(), hand_pos_true, online, decoder)
                 
         # draw hand
         azim, elev = ax_hand.azim, ax_hand.elev     # get current view
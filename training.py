@@ -0,0 +1,336 @@
+"""
+Importable decoder training API, used by main_train_decoder.py, main_sweep.py and main_export_decoder.py:
+
+    data = training.prepare_data("dataset_20231012_250sec_random.pkl", training.load_fakebrain("cursorbrain_100_01"))
+    model, results = training.train_decoder(data, decoder_type="ridge", seq_len=5)
+    training.save_decoder(model, data, results["seq_len"], "cursorridge2")
+"""
+import os
+import pickle
+import numpy as np
+import torch
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+import data_cache
+import data_loading
+import decoders.kalman
+import decoders.ridge
+import decoders.rnn
+import parallel
+from decoders.metrics import RunningMetrics
+
+
+DECODER_TYPES = ("ridge", "kalman", "rnn")
+FAKEBRAIN_DIR = os.path.join("data", "fakebrains")
+DECODER_DIR = os.path.join("data", "trained_decoders")
+
+
+class TrainingData:
+    """
+    The normalized train/test split of one simulated dataset, plus the scalers & fake brain that produced it.
+    An optional separate validation split is used for early stopping instead of the test split (see cross_validate)
+    """
+    def __init__(self, x_train_norm, x_test_norm, y_train_norm, y_test_norm, neural_scaler, output_scaler,
+                 fake_brain=None, dataset_fname=None, x_val_norm=None, y_val_norm=None):
+        self.x_train_norm = x_train_norm
+        self.x_test_norm = x_test_norm
+        self.y_train_norm = y_train_norm
+        self.y_test_norm = y_test_norm
+        self.neural_scaler = neural_scaler
+        self.output_scaler = output_scaler
+        self.fake_brain = fake_brain
+        self.dataset_fname = dataset_fname
+        self.x_val_norm = x_val_norm
+        self.y_val_norm = y_val_norm
+
+    @property
+    def num_chans(self):
+        return self.x_train_norm.shape[1]
+
+    @property
+    def num_dof(self):
+        return self.y_train_norm.shape[1] // 2
+
+    def arrays(self):
+        return {"x_train_norm": self.x_train_norm, "x_test_norm": self.x_test_norm,
+                "y_train_norm": self.y_train_norm, "y_test_norm": self.y_test_norm}
+
+
+def load_movement(dataset_fname, verbose=True):
+    """Returns (pos, vel) for a movement dataset, each of shape (num_timepts, num_dof)"""
+    movedata = data_loading.load_movedata(data_loading.movedata_path(dataset_fname))
+    pos = movedata["current_position"]                                             # shape (num_timepts, num_dof)
+    vel = np.vstack((np.zeros((1, pos.shape[1])), pos[1:, :] - pos[:-1, :]))       # vel is the derivative of pos
+    if verbose:
+        num_trials = movedata["trial_number"][-1] - movedata["trial_number"][0]
+        num_secs = (movedata["timestep"][-1] - movedata["timestep"][0]) / 1000
+        print(f"Loaded {num_trials} trials, with {num_secs:.1f} seconds of data")
+        print(f"Number of samples: {pos.shape[0]}")
+    return pos, vel
+
+
+def load_fakebrain(name, verbose=True):
+    """Load a fake brain saved by main_create_fakebrain.py"""
+    if not name.endswith(".pkl"):
+        name += ".pkl"
+    with open(os.path.join(FAKEBRAIN_DIR, name), 'rb') as f:
+        fake_brain, num_chans, num_dof = pickle.load(f)
+    if verbose:
+        print(f"Loaded fake brain: {name}")
+    return fake_brain
+
+
+def simulate_data(dataset_fname, fake_brain, seed=0, use_cache=True, verbose=True):
+    """
+    Simulated neural data for the whole (unsplit) movement dataset, e.g. for cross-validation.
+
+    Returns:
+    - neural: np.array of shape (num_timepts, num_chans)
+    - posvel: np.array of shape (num_timepts, 2 * num_dof)
+    """
+    dataset_path = data_loading.movedata_path(dataset_fname)
+    cache = data_cache.DataCache()
+    cache_key = data_cache.cache_key(fake_brain=data_cache.hash_object(fake_brain),
+                                     dataset=data_cache.hash_file(dataset_path),
+                                     seed=seed)
+    cached = cache.load(cache_key) if use_cache else None
+    if cached is not None:
+        arrays, _ = cached
+        if verbose:
+            print(f"Loaded simulated neural data from cache ({cache_key[:12]})")
+        return arrays["neural"], arrays["posvel"]
+
+    pos, vel = load_movement(dataset_fname, verbose=verbose)
+    if pos.shape[1] != fake_brain.num_dof:
+        raise ValueError(f"Fake brain has {fake_brain.num_dof} DoF, but the dataset has {pos.shape[1]}")
+
+    neural, posvel = _simulate(fake_brain, pos, vel, seed)
+    if use_cache:
+        cache.save(cache_key, {"neural": neural, "posvel": posvel})
+    return neural, posvel
+
+
+def _simulate(fake_brain, pos, vel, seed):
+    # generate fake neural data from the movements
+    np.random.seed(seed)
+    neural = fake_brain.generate(pos=pos, vel=vel)      # shape (num_timepts, num_chans)
+    return neural, np.hstack((pos, vel))
+
+
+def prepare_data(dataset_fname, fake_brain, seed=0, train_data_frac=0.8, use_cache=True, verbose=True):
+    """
+    Simulate neural data for a movement dataset, split it into train/test (contiguous, no shuffling) and normalize.
+    The result only depends on the fake brain, dataset, seed and train_data_frac, so it's cached across runs (e.g.
+    hyperparameter sweeps) in data/cache.
+    """
+    dataset_path = data_loading.movedata_path(dataset_fname)
+    pos, vel = load_movement(dataset_fname, verbose=verbose)
+    if pos.shape[1] != fake_brain.num_dof:
+        raise ValueError(f"Fake brain has {fake_brain.num_dof} DoF, but the dataset has {pos.shape[1]}")
+
+    cache = data_cache.DataCache()
+    cache_key = data_cache.cache_key(fake_brain=data_cache.hash_object(fake_brain),
+                                     dataset=data_cache.hash_file(dataset_path),
+                                     seed=seed,
+                                     train_data_frac=train_data_frac)
+    cached = cache.load(cache_key) if use_cache else None
+    if cached is not None:
+        arrays, scalers = cached
+        if verbose:
+            print(f"Loaded simulated neural data from cache ({cache_key[:12]})")
+        return TrainingData(**arrays, **scalers, fake_brain=fake_brain, dataset_fname=os.path.basename(dataset_path))
+
+    neural, posvel = _simulate(fake_brain, pos, vel, seed)
+
+    # split train/test
+    x_train, x_test, y_train, y_test = train_test_split(neural, posvel, train_size=train_data_frac, shuffle=False)
+
+    # normalize inputs & outputs
+    neural_scaler = StandardScaler()
+    neural_scaler.fit(x_train)
+    output_scaler = StandardScaler()
+    output_scaler.fit(y_train)
+    data = TrainingData(neural_scaler.transform(x_train), neural_scaler.transform(x_test),
+                        output_scaler.transform(y_train), output_scaler.transform(y_test),
+                        neural_scaler, output_scaler, fake_brain=fake_brain,
+                        dataset_fname=os.path.basename(dataset_path))
+
+    # windows are built lazily from the contiguous arrays, so seq_len isn't part of the cached data
+    if use_cache:
+        cache.save(cache_key, data.arrays(), {"neural_scaler": neural_scaler, "output_scaler": output_scaler})
+    return data
+
+
+def train_decoder(data, decoder_type="rnn", rnn_type="rnn", hidden_size=decoders.rnn.RNN_CONFIG["hidden_size"],
+                  seq_len=20, lmbda=0.1, ridge_cv=False, epochs=50, batch_size=256, tbptt=False, chunk_len=100,
+                  num_streams=16, patience=5, checkpoint_path=None, checkpoint_every=1, resume=False, verbose=True):
+    """
+    Train and evaluate one decoder on a TrainingData split.
+
+    Returns:
+    - model: the trained decoder
+    - results: dict with the test set "y" and "yhat" (unnormalized), "mse" & "corr" (per output, normalized units),
+      "loss_history" (per epoch for RNNs, else None), and the "seq_len" to save the decoder with (1 for decoders that
+      keep their own state online)
+    """
+    x_train_norm, x_test_norm = data.x_train_norm, data.x_test_norm
+    y_train_norm, y_test_norm = data.y_train_norm, data.y_test_norm
+    num_outputs = 2 * data.num_dof   # both pos & vel for each dof
+    loss_history = None
+
+    if decoder_type == 'ridge':
+        # add time history (results in a strided view of shape (num_samples, seq_len, num_chans))
+        x_train_norm_hist = data_loading.add_time_history(x_train_norm, seq_len=seq_len, strided=True)
+        x_test_norm_hist = data_loading.add_time_history(x_test_norm, seq_len=seq_len, strided=True)
+        num_inputs_rr = x_train_norm_hist.shape[1] * x_train_norm_hist.shape[2]
+        model = decoders.ridge.RidgeRegression(num_inputs_rr, num_outputs, lmbda=lmbda, dtype=x_train_norm.dtype)
+        if ridge_cv:
+            model.fit_path(x_train_norm_hist, y_train_norm, lambdas=np.logspace(-3, 4, 30), gap=seq_len,
+                           verbose=verbose)
+        else:
+            model.fit(x_train_norm_hist, y_train_norm)
+        y, yhat, mse, corr = model.eval_perf(x_test_norm_hist, y_test_norm, verbose=verbose)
+
+    elif decoder_type == 'kalman':
+        # the filter carries its own state, so it's fit & run on the contiguous (no time history) data
+        model = decoders.kalman.KalmanFilter(data.num_chans, num_outputs, dtype=x_train_norm.dtype)
+        model.fit(x_train_norm, y_train_norm)
+        y, yhat, mse, corr = model.eval_perf(x_test_norm, y_test_norm, verbose=verbose)
+        seq_len = 1
+
+    elif decoder_type == 'rnn':
+        # setup model and optimizer (we use the default hyperparams stored in the rnn.py module)
+        device = torch.device('cuda:0') if torch.cuda.is_available() else 'cpu'
+        model = decoders.rnn.RNN(data.num_chans, num_outputs, hidden_size=hidden_size, rnn_type=rnn_type,
+                                 device=device)
+        optimizer = torch.optim.Adam(model.parameters(),
+                                     lr=decoders.rnn.RNN_CONFIG["lr"],
+                                     weight_decay=decoders.rnn.RNN_CONFIG["weight_decay"])
+        loss_fn = torch.nn.MSELoss()
+        train_kwargs = {"patience": patience or None, "checkpoint_path": checkpoint_path,
+                        "checkpoint_every": checkpoint_every, "resume": resume}
+
+        # train & evaluate accuracy (early stopping uses the validation split if there is one, else the held-out split)
+        x_val_norm, y_val_norm = ((data.x_val_norm, data.y_val_norm) if data.x_val_norm is not None
+                                  else (x_test_norm, y_test_norm))
+        if tbptt:
+            # stateful training on contiguous chunks, evaluated by decoding the test data statefully (as done online)
+            chunks_train = data_loading.ContiguousChunks(x_train_norm, y_train_norm, num_streams=num_streams,
+                                                         chunk_len=chunk_len)
+            loss_history = model.fit_tbptt(chunks_train, optimizer, loss_fn, epochs, verbose=verbose,
+                                           val_data=(x_val_norm, y_val_norm), **train_kwargs)
+            y, yhat, mse, corr = model.eval_perf_sequence(x_test_norm, y_test_norm, verbose=verbose)
+        else:
+            # windows are built lazily from the contiguous normalized data, one gather per batch
+            dataset_train = data_loading.WindowedDataset(x_train_norm, y_train_norm, seq_len)
+            dataset_test = data_loading.WindowedDataset(x_test_norm, y_test_norm, seq_len)
+            loader_train = data_loading.batch_loader(dataset_train, batch_size=batch_size, shuffle=True,
+                                                     drop_last=True)
+            loader_test = data_loading.batch_loader(dataset_test, batch_size=batch_size, shuffle=False,
+                                                    drop_last=False)
+            loader_val = loader_test
+            if data.x_val_norm is not None:
+                loader_val = data_loading.batch_loader(data_loading.WindowedDataset(x_val_norm, y_val_norm, seq_len),
+                                                       batch_size=batch_size, shuffle=False, drop_last=False)
+            loss_history = model.fit(loader_train, optimizer, loss_fn, epochs, verbose=verbose,
+                                     val_loader=loader_val, **train_kwargs)
+            y, yhat, mse, corr = model.eval_perf(loader_test, verbose=verbose)
+        seq_len = 1     # for online RNNs we maintain a hidden state and only need one timestep
+    else:
+        raise ValueError(f"Invalid decoder type: {decoder_type}")
+
+    results = {"y": data.output_scaler.inverse_transform(y), "yhat": data.output_scaler.inverse_transform(yhat),
+               "mse": mse, "corr": corr, "loss_history": loss_history, "seq_len": seq_len}
+    return model, results
+
+
+def cross_validate(dataset_fname, fake_brain, decoder_type="rnn", num_folds=5, gap=None, seq_len=20, lmbda=0.1,
+                   val_frac=0.1, seed=0, workers=1, threads_per_worker=1, use_cache=True, verbose=True,
+                   **train_kwargs):
+    """
+    Blocked k-fold cross-validation over the whole recording: each contiguous fold is held out in turn, with `gap`
+    samples on either side of it left out of training (defaults to seq_len, or 1 for decoders without time history).
+
+    Nothing about a held-out fold is used before it's scored: each fold is normalized with scalers fit on its own
+    training samples, and RNNs early-stop on a validation block carved from the end of the training data (the last
+    val_frac of its longest training range, after another gap) rather than on the held-out fold.
+    Ridge folds share one pass of X^T X accumulation, with each fold's normalization applied to the shared statistics
+    (RidgeRegression.cross_validate), so they cost about one fit; only windows with a full seq_len history are used.
+    Other decoders are trained with train_decoder (extra keyword arguments are passed on), one fold per worker
+    process, with the data in shared memory. A fold's training data is the recording before and after it, joined,
+    so only the few windows spanning the join mix the two.
+
+    Returns:
+    - list of RunningMetrics, one per fold, with the held-out mse & corr per output (in each fold's normalized units)
+    """
+    neural, posvel = simulate_data(dataset_fname, fake_brain, seed=seed, use_cache=use_cache, verbose=verbose)
+    if gap is None:
+        gap = seq_len if decoder_type == "ridge" or (decoder_type == "rnn" and not train_kwargs.get("tbptt")) else 1
+
+    if decoder_type == "ridge":
+        # the time history is built over the whole recording, so held-out windows at a fold's start see their history
+        x_hist = data_loading.add_time_history(neural, seq_len=seq_len, strided=True)[seq_len - 1:]
+        model = decoders.ridge.RidgeRegression(x_hist.shape[1] * x_hist.shape[2], posvel.shape[1], lmbda=lmbda,
+                                               dtype=neural.dtype)
+        fold_metrics = model.cross_validate(x_hist, posvel[seq_len - 1:], num_folds=num_folds, gap=gap,
+                                            standardize=True)
+    else:
+        folds = data_loading.blocked_folds(len(neural), num_folds, gap)
+        fold_kwargs = {"decoder_type": decoder_type, "seq_len": seq_len, **train_kwargs}
+        val_frac = val_frac if decoder_type == "rnn" else 0     # only RNNs use a validation set
+        with parallel.SharedArrays({"neural": neural, "posvel": posvel}) as shared:
+            with parallel.process_pool(min(workers, num_folds), threads_per_worker) as pool:
+                futures = [pool.submit(_train_fold, shared.specs, test_range, train_ranges, gap, val_frac, fold_kwargs)
+                           for test_range, train_ranges in folds]
+                fold_metrics = [future.result() for future in futures]
+
+    if verbose:
+        for i, metrics in enumerate(fold_metrics):
+            print(f"fold {i + 1}/{num_folds}: ", end="")
+            metrics.report()
+    return fold_metrics
+
+
+def _train_fold(specs, test_range, train_ranges, gap, val_frac, fold_kwargs):
+    # runs in a worker process, on the shared raw recording
+    arrays = parallel.attach(specs)
+    neural, posvel = arrays["neural"], arrays["posvel"]
+
+    # the validation block comes from the end of the longest training range, separated from the rest by a gap
+    val_range = None
+    if val_frac > 0:
+        lo, hi = max(train_ranges, key=lambda r: r[1] - r[0])
+        num_val = int(val_frac * sum(stop - start for start, stop in train_ranges))
+        val_range = (hi - num_val, hi)
+        train_ranges = [(start, stop) if (start, stop) != (lo, hi) else (lo, hi - num_val - gap)
+                        for start, stop in train_ranges]
+        train_ranges = [(start, stop) for start, stop in train_ranges if stop > start]
+
+    # scalers are fit on this fold's training samples only
+    x_train = np.concatenate([neural[lo:hi] for lo, hi in train_ranges])
+    y_train = np.concatenate([posvel[lo:hi] for lo, hi in train_ranges])
+    neural_scaler = StandardScaler().fit(x_train)
+    output_scaler = StandardScaler().fit(y_train)
+    a, b = test_range
+    val = {}
+    if val_range is not None:
+        val = {"x_val_norm": neural_scaler.transform(neural[val_range[0]:val_range[1]]),
+               "y_val_norm": output_scaler.transform(posvel[val_range[0]:val_range[1]])}
+    data = TrainingData(neural_scaler.transform(x_train), neural_scaler.transform(neural[a:b]),
+                        output_scaler.transform(y_train), output_scaler.transform(posvel[a:b]),
+                        neural_scaler, output_scaler, **val)
+
+    _, results = train_decoder(data, **fold_kwargs, verbose=False)
+    metrics = RunningMetrics(posvel.shape[1])
+    metrics.update(output_scaler.transform(results["y"]), output_scaler.transform(results["yhat"]))
+    return metrics
+
+
+def save_decoder(model, data, seq_len, save_name):
+    """Save a decoder in the format main_run_task.py loads: (model, fake_brain, neural_scaler, output_scaler, seq_len)"""
+    if not save_name.endswith(".pkl"):
+        save_name += ".pkl"
+    with open(os.path.join(DECODER_DIR, save_name), 'wb') as f:
+        pickle.dump((model, data.fake_brain, data.neural_scaler, data.output_scaler, seq_len), f)
+    print(f"Saved decoder to {save_name}")